@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.json")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Jaccard similarity of character trigrams needed to reuse a near-duplicate's answer
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.75"))
+ANSWER_CACHE_SAVE_SECONDS = int(os.getenv("ANSWER_CACHE_SAVE_SECONDS", "300"))
+
+# A near-duplicate must also use the same words once these are ignored, so an
+# extra "not" or a different employer never reuses another question's answer.
+# Negations ("not", "no", "never", "don t"...) are deliberately absent.
+STOPWORDS = {
+    "a", "an", "the", "i", "me", "my", "we", "our", "you", "your", "it", "its",
+    "is", "am", "are", "was", "be", "do", "does", "did", "can", "could", "should",
+    "would", "will", "to", "of", "in", "on", "at", "for", "with", "about", "and",
+    "or", "how", "what", "which", "when", "so", "that", "this", "please", "any",
+    "some", "just", "really", "hey", "hi",
+}
+
+# normalised question -> {"answer": str, "created": float}; order = LRU, oldest first
+_entries: OrderedDict[str, dict] = OrderedDict()
+# trigram -> normalised questions containing it (near-duplicate candidates)
+_index: dict[str, set[str]] = {}
+_dirty = False
+_stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+# =========================================
+# Public API
+# =========================================
+def normalise(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+def get(question: str) -> str | None:
+    """Cached answer for the question or a near-duplicate of it, else None."""
+    key = normalise(question)
+    if not key:
+        return None
+    entry = _live(key)
+    if entry is not None:
+        _stats["exact_hits"] += 1
+        return entry["answer"]
+    similar = _most_similar(key)
+    if similar is not None:
+        _stats["similar_hits"] += 1
+        return _entries[similar]["answer"]
+    _stats["misses"] += 1
+    return None
+
+def put(question: str, answer: str):
+    global _dirty
+    key = normalise(question)
+    if not key or not answer:
+        return
+    if key in _entries:
+        _drop(key)
+    _entries[key] = {"answer": answer, "created": time.time()}
+    for gram in _trigrams(key):
+        _index.setdefault(gram, set()).add(key)
+    _stats["stores"] += 1
+    _dirty = True
+    while len(_entries) > ANSWER_CACHE_MAX_ENTRIES:
+        _drop(next(iter(_entries)))
+        _stats["evictions"] += 1
+
+def load():
+    """Read the cache persisted by `save` (call on startup)."""
+    try:
+        with open(ANSWER_CACHE_PATH, encoding="utf-8") as f:
+            items = json.load(f)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error(f"Could not load answer cache from {ANSWER_CACHE_PATH}: {e}")
+        return
+    now = time.time()
+    for key, entry in items:
+        if now - entry["created"] < ANSWER_CACHE_TTL_SECONDS:
+            _entries[key] = entry
+            for gram in _trigrams(key):
+                _index.setdefault(gram, set()).add(key)
+    while len(_entries) > ANSWER_CACHE_MAX_ENTRIES:
+        _drop(next(iter(_entries)))
+    logger.info(f"Answer cache loaded: {len(_entries)} entries")
+
+async def save():
+    """Persist entries (LRU order) if anything changed; the file write runs off the event loop."""
+    global _dirty
+    if not _dirty:
+        return
+    _dirty = False
+    items = list(_entries.items())
+    try:
+        await asyncio.to_thread(_write, items)
+    except Exception as e:
+        _dirty = True
+        logger.error(f"Could not save answer cache to {ANSWER_CACHE_PATH}: {e}")
+
+def start(job_queue):
+    job_queue.run_repeating(_save_job, interval=ANSWER_CACHE_SAVE_SECONDS, name="answer-cache-save")
+
+def get_stats() -> dict:
+    hits = _stats["exact_hits"] + _stats["similar_hits"]
+    lookups = hits + _stats["misses"]
+    return {
+        **_stats,
+        "entries": len(_entries),
+        "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+    }
+
+# =========================================
+# Internals
+# =========================================
+async def _save_job(context: ContextTypes.DEFAULT_TYPE):
+    await save()
+
+def _write(items: list):
+    tmp = f"{ANSWER_CACHE_PATH}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(items, f)
+    os.replace(tmp, ANSWER_CACHE_PATH)
+
+def _trigrams(key: str) -> set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _content_words(key: str) -> set[str]:
+    return set(key.split()) - STOPWORDS
+
+def _live(key: str) -> dict | None:
+    """The entry for `key` if present and fresh; refreshes its LRU position."""
+    entry = _entries.get(key)
+    if entry is None:
+        return None
+    if time.time() - entry["created"] >= ANSWER_CACHE_TTL_SECONDS:
+        _drop(key)
+        _stats["evictions"] += 1
+        return None
+    _entries.move_to_end(key)
+    return entry
+
+def _most_similar(key: str) -> str | None:
+    grams = _trigrams(key)
+    shared = Counter()
+    for gram in grams:
+        shared.update(_index.get(gram, ()))
+    best, best_score = None, ANSWER_CACHE_SIMILARITY
+    for candidate, common in shared.most_common():
+        # Candidates come in falling shared-trigram order; stop once none can qualify
+        if common / len(grams) < best_score:
+            break
+        score = common / (len(grams) + len(_trigrams(candidate)) - common)
+        if score < best_score or _content_words(candidate) != _content_words(key):
+            continue
+        if _live(candidate) is not None:
+            best, best_score = candidate, score
+    return best
+
+def _drop(key: str):
+    global _dirty
+    _entries.pop(key, None)
+    for gram in _trigrams(key):
+        keys = _index.get(gram)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _index[gram]
+    _dirty = True
@@ -1,12 +1,13 @@
-import requests
-import sqlite3
+import os
+import time
 import datetime
-import httpx
-import json
 import logging
+from typing import AsyncIterator
 from telegram import Update
 from telegram.ext import CommandHandler, MessageHandler, filters, ConversationHandler, ContextTypes
-from config import OPENROUTER_API_KEY  # 🔐 Updated
+from db import acquire
+import answer_cache
+import llm_gateway
 
 # --- ADD THIS LOGGING SETUP ---
 logging.basicConfig(
@@ -17,133 +18,144 @@ logger = logging.getLogger(__name__)
 # ------------------------------
 
 # ========== LLM CALL ==========
+ASK_MODEL = "mistralai/mistral-7b-instruct"
+ASK_SYSTEM_PROMPT = "You are JobPal, a tough love career coach who gives direct, motivational advice with a military/coach style tone. Use phrases like 'soldier', 'recruit', 'let's crush this', etc."
+ASK_TIMEOUT = float(os.getenv("ASK_TIMEOUT", "60"))
+# Minimum gap between placeholder edits while streaming (Telegram throttles edits)
+ASK_STREAM_EDIT_SECONDS = float(os.getenv("ASK_STREAM_EDIT_SECONDS", "1.0"))
+TELEGRAM_MAX_MESSAGE = 4096
+
+async def stream_jobpal_ai(question: str) -> AsyncIterator[str]:
+    """Yield the answer in pieces as the provider streams them (via llm_gateway)."""
+    messages = [
+        {"role": "system", "content": ASK_SYSTEM_PROMPT},
+        {"role": "user", "content": question}
+    ]
+    async for piece in llm_gateway.stream(messages, site="ask", model=ASK_MODEL, deadline=ASK_TIMEOUT):
+        yield piece
+
 async def ask_jobpal_ai(question: str) -> str:
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "mistralai/mistral-7b-instruct",
-        "messages": [
-            {"role": "system", "content": "You are JobPal, a tough love career coach who gives direct, motivational advice with a military/coach style tone. Use phrases like 'soldier', 'recruit', 'let's crush this', etc."},
-            {"role": "user", "content": question}
-        ]
-    }
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=60.0
-            )
-            response.raise_for_status()
-
-        response_data = response.json()
-
-        if "choices" in response_data and len(response_data["choices"]) > 0:
-            message = response_data["choices"][0].get("message", {})
-            content = message.get("content")
-            if content:
-                return content
-            else:
-                logger.error("AI response missing 'content'. Full response: %s", response_data)
-                raise ValueError("AI response format error: missing content")
-        else:
-            logger.error("AI response missing 'choices'. Full response: %s", response_data)
-            raise ValueError("AI response format error: missing choices")
-
-    except httpx.HTTPStatusError as e:
-        logger.error(f"OpenRouter API request failed: {e.response.status_code} - {e.response.text}")
-        raise ValueError(f"AI Service Error ({e.response.status_code})")
-    except httpx.RequestError as e:
-        logger.error(f"Network error connecting to OpenRouter API: {e}")
-        raise ConnectionError("Network error contacting AI service")
-    except Exception as e:
-        logger.error(f"Error processing AI response in ask_jobpal_ai: {e}", exc_info=True)
-        raise ValueError("Invalid response/error processing AI result")
-
-# ========== DB INIT ==========
-def init_question_db():
-    conn = sqlite3.connect("jobpal.db")
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS user_questions (
-            user_id INTEGER,
-            date TEXT,
-            count INTEGER
+    """The whole answer at once (for callers that can't show partial text)."""
+    content = "".join([piece async for piece in stream_jobpal_ai(question)])
+    if not content:
+        raise ValueError("AI response format error: missing content")
+    return content
+
+# ========== QUOTA ==========
+# Daily /ask questions per users.tier, e.g. ASK_TIER_LIMITS="free:2,pro:20"
+ASK_TIER_LIMITS = {
+    tier.strip(): int(limit)
+    for tier, limit in (item.split(":") for item in os.getenv("ASK_TIER_LIMITS", "free:2,pro:20").split(",") if item)
+}
+ASK_DEFAULT_LIMIT = int(os.getenv("ASK_DEFAULT_LIMIT", "2"))
+
+def limit_for_tier(tier: str | None) -> int:
+    return ASK_TIER_LIMITS.get(tier or "free", ASK_DEFAULT_LIMIT)
+
+async def _get_limit(conn, user_id: int) -> int:
+    tier = await conn.fetchval("SELECT tier FROM users WHERE user_id = $1", user_id)
+    return limit_for_tier(tier)
+
+async def check_question_limit(user_id: int) -> bool:
+    """True when the user has used up today's questions (read-only, for the /ask prompt)."""
+    async with acquire() as conn:
+        limit = await _get_limit(conn, user_id)
+        used = await conn.fetchval(
+            "SELECT count FROM ask_usage WHERE user_id = $1 AND date = $2",
+            user_id, datetime.date.today()
         )
-    """)
-    conn.commit()
-    conn.close()
-
-def init_goal_and_progress_tables():
-    conn = sqlite3.connect("jobpal.db")
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS user_goals (
-            user_id INTEGER,
-            weekday TEXT,
-            goal_count INTEGER
+    return (used or 0) >= limit
+
+async def reserve_question(user_id: int) -> bool:
+    """
+    Atomically take one of today's questions. The upsert only bumps the count
+    while it is under the limit, so concurrent questions can't overshoot it.
+    """
+    async with acquire() as conn:
+        limit = await _get_limit(conn, user_id)
+        if limit <= 0:
+            return False
+        count = await conn.fetchval(
+            """
+            INSERT INTO ask_usage (user_id, date, count) VALUES ($1, $2, 1)
+            ON CONFLICT (user_id, date) DO UPDATE SET count = ask_usage.count + 1
+            WHERE ask_usage.count < $3
+            RETURNING count
+            """,
+            user_id, datetime.date.today(), limit
         )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS user_progress (
-            user_id INTEGER,
-            date TEXT,
-            count_applied INTEGER
+    return count is not None
+
+async def refund_question(user_id: int):
+    """Give a reserved question back when the AI call failed."""
+    async with acquire() as conn:
+        await conn.execute(
+            "UPDATE ask_usage SET count = count - 1 WHERE user_id = $1 AND date = $2 AND count > 0",
+            user_id, datetime.date.today()
         )
-    """)
-    conn.commit()
-    conn.close()
-
-# ========== LIMIT CHECK ==========
-def check_question_limit(user_id: int) -> bool:
-    today = datetime.date.today().isoformat()
-    conn = sqlite3.connect("jobpal.db")
-    c = conn.cursor()
-    c.execute("SELECT count FROM user_questions WHERE user_id = ? AND date = ?", (user_id, today))
-    row = c.fetchone()
-    conn.close()
-    return row and row[0] >= 2
-
-def log_question(user_id: int):
-    today = datetime.date.today().isoformat()
-    conn = sqlite3.connect("jobpal.db")
-    c = conn.cursor()
-    c.execute("SELECT count FROM user_questions WHERE user_id = ? AND date = ?", (user_id, today))
-    row = c.fetchone()
-    if row:
-        c.execute("UPDATE user_questions SET count = count + 1 WHERE user_id = ? AND date = ?", (user_id, today))
-    else:
-        c.execute("INSERT INTO user_questions (user_id, date, count) VALUES (?, ?, 1)", (user_id, today))
-    conn.commit()
-    conn.close()
 
 # ========== CONVERSATION HANDLER ==========
 ASKING = range(1)
+LIMIT_TEXT = "⚠️ HOLD UP, SOLDIER! You've hit your daily question limit. Reset at 0000 hours!"
 
 async def ask_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.message.chat.id
-    if check_question_limit(user_id):
-        await update.message.reply_text("⚠️ HOLD UP, SOLDIER! You've hit your daily question limit. Reset at 0600 hours!")
+    user_id = update.effective_user.id
+    if await check_question_limit(user_id):
+        await update.message.reply_text(LIMIT_TEXT)
         return ConversationHandler.END
     await update.message.reply_text("🎯 ALRIGHT RECRUIT! What's your career question? Make it count!")
     return ASKING
 
 async def ask_receive(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.message.chat.id
+    user_id = update.effective_user.id
     question = update.message.text
-    await update.message.reply_text("💭 ANALYZING YOUR SITUATION...")
+    cached = answer_cache.get(question)
+    if cached:
+        # Near-identical questions are answered locally and don't count against the quota
+        await update.message.reply_text(cached)
+        return ConversationHandler.END
+    if not await reserve_question(user_id):
+        await update.message.reply_text(LIMIT_TEXT)
+        return ConversationHandler.END
+    placeholder = await update.message.reply_text("💭 ANALYZING YOUR SITUATION...")
+    answer = ""
+    shown = ""
+    last_edit = 0.0
     try:
-        answer = await ask_jobpal_ai(question)
-        await update.message.reply_text(answer)
-        log_question(user_id)
+        async for piece in stream_jobpal_ai(question):
+            answer += piece
+            # Edit the placeholder as text arrives, at most once per ASK_STREAM_EDIT_SECONDS
+            preview = answer.strip()[:TELEGRAM_MAX_MESSAGE - 2]
+            if preview != shown and time.monotonic() - last_edit >= ASK_STREAM_EDIT_SECONDS:
+                await _edit(placeholder, f"{preview} ▍")
+                shown = preview
+                last_edit = time.monotonic()
+        answer = answer.strip()
+        if not answer:
+            raise ValueError("AI response format error: missing content")
     except Exception as e:
-        await update.message.reply_text("❌ TECHNICAL DIFFICULTIES, SOLDIER! Regroup and try again!")
-        print("LLM error:", e)
+        await refund_question(user_id)
+        await _edit(placeholder, "❌ TECHNICAL DIFFICULTIES, SOLDIER! Regroup and try again!")
+        logger.error(f"LLM error for user {user_id}: {e}")
+        return ConversationHandler.END
+
+    parts = [answer[i:i + TELEGRAM_MAX_MESSAGE] for i in range(0, len(answer), TELEGRAM_MAX_MESSAGE)]
+    if not await _edit(placeholder, parts[0]):
+        await update.message.reply_text(parts[0])
+    for part in parts[1:]:
+        await update.message.reply_text(part)
+    answer_cache.put(question, answer)
     return ConversationHandler.END
 
+async def _edit(message, text: str) -> bool:
+    """Edit a message in place; a skipped edit (rate limit, unchanged text) is not fatal."""
+    try:
+        await message.edit_text(text)
+        return True
+    except Exception as e:
+        logger.debug(f"/ask edit skipped: {e}")
+        return False
+
 async def ask_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("MISSION ABORTED! Ready when you are to try again, soldier! 💪")
     return ConversationHandler.END
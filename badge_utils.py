@@ -1,184 +1,374 @@
-import sqlite3
 import logging
-from datetime import datetime, date, timedelta
+from datetime import date, timedelta
+from db import acquire, DEFAULT_TIMEZONE
+import today_cache
+import scheduler
 
 logger = logging.getLogger(__name__)
 
+STREAK_LOOKBACK_DAYS = 90  # Check up to 90 days back reasonably
+
 # =======================================
-# Helper Functions for Badge Logic
+# Stats Snapshot (one query per evaluation)
 # =======================================
 
-def get_total_apps(user_id: int) -> int:
-    """Gets the total number of applications logged by the user."""
-    conn = None
-    try:
-        conn = sqlite3.connect("jobpal.db")
-        c = conn.cursor()
-        c.execute("SELECT SUM(count_applied) FROM user_progress WHERE user_id = ?", (user_id,))
-        total = c.fetchone()
-        conn.close()
-        return total[0] if total and total[0] is not None else 0
-    except Exception as e:
-        logger.error(f"Error getting total apps for user {user_id}: {e}", exc_info=True)
-        if conn: conn.close()
-        return 0
-
-def get_streak_days(user_id: int) -> int:
-    """Calculates the current consecutive day streak of logging applications."""
-    conn = None
-    streak = 0
-    try:
-        conn = sqlite3.connect("jobpal.db")
-        c = conn.cursor()
-        # Check days backwards until a gap is found
-        for i in range(90): # Check up to 90 days back reasonably
-            check_date = (date.today() - timedelta(days=i)).strftime("%Y-%m-%d")
-            c.execute("SELECT 1 FROM user_progress WHERE user_id = ? AND date = ? AND count_applied > 0 LIMIT 1", (user_id, check_date))
-            if c.fetchone():
-                streak += 1
-            else:
-                break # Gap found, streak ends
-        conn.close()
-    except Exception as e:
-        logger.error(f"Error calculating streak for user {user_id}: {e}", exc_info=True)
-        if conn: conn.close()
-    return streak
-
-def get_weekday_goals_met_this_week(user_id: int) -> int:
-    """Calculates how many weekday goals were met in the current week."""
-    # This is complex, placeholder implementation
-    # Needs to fetch goals Mon-Fri and progress Mon-Fri for current week
-    logger.warning(f"Weekly goal met check logic not fully implemented for user {user_id}")
-    # Placeholder: return a sample number
-    return 3 # Example: User met goal on 3 weekdays
+async def load_badge_stats(user_ids: list[int] | None = None) -> dict[int, dict]:
+    """
+    Loads badge stats for the given users (or everyone) in a single query:
+    total applications (from the monthly rollups), current streak of active
+    days (alive while the last log was today or yesterday), and weekdays this
+    week where the goal was met, each on the user's own local date. Daily rows
+    are only read for the streak window.
+    """
+    # Unflushed taps must count towards badges; the flush refreshes the rollups too
+    await today_cache.flush()
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            """
+            WITH totals AS (
+              SELECT user_id, SUM(done_sum) AS total_apps
+              FROM monthly_rollup
+              WHERE ($1::BIGINT[] IS NULL OR user_id = ANY($1::BIGINT[]))
+              GROUP BY user_id
+            ),
+            -- Each user's own local today and Monday (daily rows are keyed by local date)
+            days AS (
+              SELECT t.user_id, l.today, l.today - (EXTRACT(ISODOW FROM l.today)::int - 1) AS monday
+              FROM totals t
+              LEFT JOIN users u ON u.user_id = t.user_id
+              CROSS JOIN LATERAL (
+                SELECT (CURRENT_TIMESTAMP AT TIME ZONE COALESCE(u.timezone, $2))::date AS today
+              ) l
+            ),
+            scoped AS (
+              SELECT dt.user_id, dt.date, dt.goal, dt.done, d.today, d.monday
+              FROM daily_track dt
+              JOIN days d ON d.user_id = dt.user_id
+              WHERE dt.date > LEAST(d.today - $3::int, d.monday - 1) AND dt.date <= d.today
+            ),
+            active AS (
+              SELECT user_id, date,
+                     MAX(date) OVER (PARTITION BY user_id) AS last_active,
+                     ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY date DESC) AS rn
+              FROM scoped
+              WHERE done > 0 AND date > today - $3::int
+            ),
+            streaks AS (
+              SELECT user_id, MAX(last_active) AS last_active, COUNT(*) AS streak_days
+              FROM active
+              WHERE (last_active - date) = rn - 1
+              GROUP BY user_id
+            ),
+            week AS (
+              SELECT user_id,
+                     COUNT(*) FILTER (WHERE goal > 0 AND done >= goal) AS weekday_goals_met,
+                     BOOL_OR(date = today AND goal > 0 AND done >= goal) AS met_today
+              FROM scoped
+              WHERE date BETWEEN monday AND monday + 4
+              GROUP BY user_id
+            )
+            SELECT t.user_id,
+                   d.today,
+                   t.total_apps,
+                   s.last_active,
+                   -- A streak stays alive until a whole day passes without a log
+                   CASE WHEN s.last_active >= d.today - 1 THEN s.streak_days ELSE 0 END AS streak_days,
+                   COALESCE(w.weekday_goals_met, 0) AS weekday_goals_met,
+                   COALESCE(w.met_today, FALSE) AS met_today
+            FROM totals t
+            JOIN days d ON d.user_id = t.user_id
+            LEFT JOIN streaks s ON s.user_id = t.user_id
+            LEFT JOIN week w ON w.user_id = t.user_id
+            """,
+            user_ids, DEFAULT_TIMEZONE, STREAK_LOOKBACK_DAYS
+        )
+    stats = {uid: empty_stats(scheduler.user_date(uid)) for uid in (user_ids or [])}
+    for r in rows:
+        stats[r["user_id"]] = {
+            **empty_stats(r["today"]),
+            "total_apps": r["total_apps"] or 0,
+            "streak_days": r["streak_days"],
+            "last_active": r["last_active"],
+            "weekday_goals_met": r["weekday_goals_met"],
+            "met_today": r["met_today"],
+        }
+    return stats
+
+def empty_stats(today: date) -> dict:
+    """
+    Snapshot shape. Rules read total_apps, streak_days and weekday_goals_met;
+    the rest lets events update the snapshot in place (see emit).
+    """
+    return {
+        "total_apps": 0,
+        "streak_days": 0,
+        "last_active": None,
+        "weekday_goals_met": 0,
+        "met_today": False,
+        "day": today,
+        "week_of": today - timedelta(days=today.weekday()),
+    }
 
 # =======================================
-# Condition Check Functions (Implement Real Logic!)
+# Condition Check Functions
 # =======================================
-# These functions determine if a user QUALIFIES for a badge RIGHT NOW
+# These functions determine if a user QUALIFIES for a badge, given a stats snapshot
 
-def is_first_log(user_id: int) -> bool:
-    return get_total_apps(user_id) > 0
+def is_first_log(stats: dict) -> bool:
+    return stats["total_apps"] > 0
 
-def has_logged_20_total(user_id: int) -> bool:
-    return get_total_apps(user_id) >= 20
+def has_logged_20_total(stats: dict) -> bool:
+    return stats["total_apps"] >= 20
 
-def has_3_day_streak(user_id: int) -> bool:
-    # Use the helper, check if it's 3 or more
-    return get_streak_days(user_id) >= 3
+def has_3_day_streak(stats: dict) -> bool:
+    return stats["streak_days"] >= 3
 
-def hit_weekly_goal(user_id: int) -> bool:
-    # Needs real implementation based on comparing progress and goals for week
-    # Example check using placeholder helper:
-    return get_weekday_goals_met_this_week(user_id) >= 5
+def hit_weekly_goal(stats: dict) -> bool:
+    return stats["weekday_goals_met"] >= 5
 
 # =======================================
 # Badge Definitions & Awarding Logic
 # =======================================
 
-# New structure including check and progress functions
 BADGE_DEFINITIONS = [
     {
         "name": "🚀 First Log!",
         "desc": "Logged your very first application!",
-        "check": is_first_log, # Function reference
-        "progress": lambda user_id: "✅ Earned!" if is_first_log(user_id) else "0 / 1 Log" # Lambda function
+        "check": is_first_log,
+        "inputs": {"total_apps"},
+        "progress": lambda stats: "✅ Earned!" if is_first_log(stats) else "0 / 1 Log"
     },
     {
         "name": "💼 Momentum Maker",
         "desc": "Logged 20+ total applications.",
         "check": has_logged_20_total,
-        "progress": lambda user_id: f"{get_total_apps(user_id)} / 20 Apps"
+        "inputs": {"total_apps"},
+        "progress": lambda stats: f"{stats['total_apps']} / 20 Apps"
     },
     {
         "name": "🔥 Lil' Flame",
         "desc": "Logged 3 days in a row. 🔥",
         "check": has_3_day_streak,
-        "progress": lambda user_id: f"{get_streak_days(user_id)} / 3 Day Streak"
+        "inputs": {"streak_days"},
+        "progress": lambda stats: f"{stats['streak_days']} / 3 Day Streak"
     },
     {
         "name": "🐯 Tiger Week",
         "desc": "Hit all your weekday goals!",
         "check": hit_weekly_goal,
-        "progress": lambda user_id: f"{get_weekday_goals_met_this_week(user_id)} / 5 Weekdays Goal Met" # Use helper
+        "inputs": {"weekday_goals_met"},
+        "progress": lambda stats: f"{stats['weekday_goals_met']} / 5 Weekdays Goal Met"
     },
     # Add more badges following this structure
 ]
 
-def award_badge_if_needed(user_id: int, badge_name: str, trigger_check_func) -> str | None:
-    """Awards badge if condition met and not already awarded. Returns badge name if awarded."""
-    # (Keep the implementation provided in the previous step, which returns badge_name or None)
-    try:
-        should_award = trigger_check_func()
-        if not should_award: return None
-    except Exception as e: logger.error(f"Err check badge '{badge_name}' user {user_id}: {e}"); return None
-    conn = None
-    try:
-        conn = sqlite3.connect("jobpal.db"); c = conn.cursor()
-        # Ensure user_badges table exists
-        c.execute("""CREATE TABLE IF NOT EXISTS user_badges (
-                        user_id INTEGER, badge_name TEXT, awarded_at TIMESTAMP,
-                        PRIMARY KEY (user_id, badge_name))""")
-        c.execute("SELECT 1 FROM user_badges WHERE user_id = ? AND badge_name = ?", (user_id, badge_name))
-        if c.fetchone(): return None # Already awarded
-        award_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        c.execute("INSERT INTO user_badges (user_id, badge_name, awarded_at) VALUES (?, ?, ?)", (user_id, badge_name, award_date))
-        conn.commit(); logger.info(f"AWARDED badge '{badge_name}' to user {user_id}"); return badge_name
-    except Exception as e: logger.error(f"DB err award badge '{badge_name}' user {user_id}: {e}"); return None
-    finally:
-        if conn: conn.close()
-
-
-def check_all_badges(user_id: int) -> list[str]:
+async def award_badges(awards: list[tuple[int, str]]) -> list[tuple[int, str]]:
+    """Inserts (user_id, badge_name) awards in one statement; returns only the new ones."""
+    if not awards:
+        return []
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            """
+            INSERT INTO user_badges (user_id, badge_name)
+            SELECT * FROM unnest($1::BIGINT[], $2::TEXT[])
+            ON CONFLICT (user_id, badge_name) DO NOTHING
+            RETURNING user_id, badge_name
+            """,
+            [uid for uid, _ in awards], [name for _, name in awards]
+        )
+    for r in rows:
+        logger.info(f"AWARDED badge '{r['badge_name']}' to user {r['user_id']}")
+    return [(r["user_id"], r["badge_name"]) for r in rows]
+
+async def check_all_badges(user_id: int) -> list[str]:
     """Checks all badge conditions, awards new ones, returns list of NEWLY awarded."""
     logger.debug(f"Running check_all_badges for user {user_id}")
-    newly_awarded_badges = []
-    # Use the check function defined within BADGE_DEFINITIONS
-    for badge_def in BADGE_DEFINITIONS:
-        badge_name = badge_def["name"]
-        condition_func = badge_def["check"] # Get the function reference
-        awarded_badge = award_badge_if_needed(user_id, badge_name, lambda: condition_func(user_id)) # Pass lambda calling the func
-        if awarded_badge:
-            newly_awarded_badges.append(awarded_badge)
+    newly_awarded_badges = (await check_badges_for_all([user_id])).get(user_id, [])
     if newly_awarded_badges: logger.info(f"User {user_id} earned new badges: {newly_awarded_badges}")
     return newly_awarded_badges
 
+async def check_badges_for_all(user_ids: list[int] | None = None) -> dict[int, list[str]]:
+    """
+    Batch evaluation (the day_closed event): reload the users' counters from
+    Postgres in one stats query, re-evaluate every rule, and award in one insert.
+    """
+    loaded = await _load(user_ids)
+    return await _evaluate({uid: ALL_INPUTS for uid in loaded})
+
+# =======================================
+# Events (incremental counters, O(1) per log)
+# =======================================
+# Snapshot fields each event can change; rules re-run only when one of their inputs did
+EVENT_INPUTS = {
+    "job_logged": {"total_apps", "streak_days", "weekday_goals_met"},
+    "goal_set": {"weekday_goals_met"},
+}
+ALL_INPUTS = set().union(*(badge["inputs"] for badge in BADGE_DEFINITIONS))
+
+_counters: dict[int, dict] = {}
+_earned: dict[int, set[str]] = {}
+# user_id -> (day, rendered /badges text)
+_summaries: dict[int, tuple[date, str]] = {}
+_event_stats = {
+    "events": 0, "loads": 0, "rules_evaluated": 0, "awarded": 0,
+    "summary_hits": 0, "summary_misses": 0,
+}
+
+async def emit(event: str, user_id: int, goal: int, done: int, n: int = 0) -> list[str]:
+    """
+    Feed one event: `goal`/`done` are today's values after it, `n` the number
+    of applications logged. Returns the badges newly awarded to the user.
+    """
+    if event not in EVENT_INPUTS:
+        raise ValueError(f"Unknown badge event: {event}")
+    _event_stats["events"] += 1
+    invalidate_summary(user_id)
+    counters = _counters.get(user_id)
+    if counters is None:
+        # First event for this user: the loaded snapshot already includes it
+        await _load([user_id])
+        changed = ALL_INPUTS
+    else:
+        changed = _apply(counters, event, goal, done, n, scheduler.user_date(user_id))
+    return (await _evaluate({user_id: changed})).get(user_id, [])
+
+def get_event_stats() -> dict:
+    return {**_event_stats, "users": len(_counters), "summaries": len(_summaries)}
+
+def _apply(counters: dict, event: str, goal: int, done: int, n: int, today: date) -> set[str]:
+    """Update a user's counters in place for their local `today`; returns the snapshot fields that changed."""
+    _roll(counters, today)
+    changed = set()
+    if event == "job_logged" and n:
+        counters["total_apps"] += n
+        changed.add("total_apps")
+        if counters["last_active"] != today:
+            yesterday = today - timedelta(days=1)
+            counters["streak_days"] = counters["streak_days"] + 1 if counters["last_active"] == yesterday else 1
+            counters["last_active"] = today
+            changed.add("streak_days")
+    met = today.weekday() < 5 and goal > 0 and done >= goal
+    if met != counters["met_today"]:
+        counters["met_today"] = met
+        counters["weekday_goals_met"] += 1 if met else -1
+        changed.add("weekday_goals_met")
+    return changed & EVENT_INPUTS[event]
+
+def _roll(counters: dict, today: date):
+    """Carry counters across midnight and into a new week."""
+    monday = today - timedelta(days=today.weekday())
+    if counters["week_of"] != monday:
+        counters["week_of"] = monday
+        counters["weekday_goals_met"] = 0
+        counters["met_today"] = False
+    if counters["day"] != today:
+        counters["day"] = today
+        counters["met_today"] = False
+    if counters["last_active"] and counters["last_active"] < today - timedelta(days=1):
+        counters["streak_days"] = 0
+
+async def _load(user_ids: list[int] | None) -> list[int]:
+    """(Re)load counters and earned badges for the users from Postgres."""
+    _event_stats["loads"] += 1
+    stats = await load_badge_stats(user_ids)
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT user_id, badge_name FROM user_badges WHERE ($1::BIGINT[] IS NULL OR user_id = ANY($1::BIGINT[]))",
+            user_ids
+        )
+    earned: dict[int, set[str]] = {uid: set() for uid in stats}
+    for r in rows:
+        earned.setdefault(r["user_id"], set()).add(r["badge_name"])
+    _counters.update(stats)
+    _earned.update(earned)
+    for uid in stats:
+        invalidate_summary(uid)
+    return list(stats)
+
+async def _evaluate(changed_by_user: dict[int, set[str]]) -> dict[int, list[str]]:
+    """Run only the not-yet-earned rules whose inputs changed; award in one insert."""
+    awards = []
+    for uid, changed in changed_by_user.items():
+        earned = _earned.setdefault(uid, set())
+        for badge_def in BADGE_DEFINITIONS:
+            if badge_def["name"] in earned or not (badge_def["inputs"] & changed):
+                continue
+            _event_stats["rules_evaluated"] += 1
+            try:
+                if badge_def["check"](_counters[uid]):
+                    awards.append((uid, badge_def["name"]))
+            except Exception as e:
+                logger.error(f"Err check badge '{badge_def['name']}': {e}")
+    try:
+        inserted = await award_badges(awards)
+    except Exception as e:
+        # Not marked earned, so the next event (or day_closed) retries
+        logger.error(f"Badge award failed for {len(awards)} award(s): {e}")
+        return {}
+    newly_awarded: dict[int, list[str]] = {}
+    for uid, name in inserted:
+        newly_awarded.setdefault(uid, []).append(name)
+        invalidate_summary(uid)
+        _event_stats["awarded"] += 1
+    # Already-held awards came back empty from ON CONFLICT; either way they are earned now
+    for uid, name in awards:
+        _earned[uid].add(name)
+    return newly_awarded
+
+def format_new_badges(names: list[str]) -> str:
+    return "\n".join(["🏅 New badge unlocked!"] + [f"• {name}" for name in names])
 
 # =======================================
 # Badge Summary Logic for /mybadges
 # =======================================
 
-def get_badges(user_id: int) -> list[tuple[str, str]]:
+async def get_badges(user_id: int) -> list[tuple[str, str]]:
     """Fetches all earned badges and formatted award dates for a user."""
-    conn = None; earned_badges_list = []
+    earned_badges_list = []
     try:
-        conn = sqlite3.connect("jobpal.db"); c = conn.cursor()
-        # Ensure user_badges table exists before querying
-        c.execute("""CREATE TABLE IF NOT EXISTS user_badges (
-                        user_id INTEGER, badge_name TEXT, awarded_at TIMESTAMP,
-                        PRIMARY KEY (user_id, badge_name))""")
-        c.execute("SELECT badge_name, awarded_at FROM user_badges WHERE user_id = ? ORDER BY awarded_at ASC", (user_id,))
-        raw_badges = c.fetchall()
-        for name, awarded_at_ts in raw_badges:
-            try: # Format the date nicely
-                dt_obj = datetime.strptime(awarded_at_ts, "%Y-%m-%d %H:%M:%S")
-                formatted_date = dt_obj.strftime("%b %d, %Y")
-            except (TypeError, ValueError): formatted_date = "Unknown Date"
-            earned_badges_list.append((name, formatted_date))
+        async with acquire() as conn:
+            raw_badges = await conn.fetch(
+                "SELECT badge_name, awarded_at FROM user_badges WHERE user_id = $1 ORDER BY awarded_at ASC",
+                user_id
+            )
+        for r in raw_badges:
+            formatted_date = r["awarded_at"].strftime("%b %d, %Y") if r["awarded_at"] else "Unknown Date"
+            earned_badges_list.append((r["badge_name"], formatted_date))
     except Exception as e: logger.error(f"Error fetching earned badges for user {user_id}: {e}")
-    finally:
-        if conn: conn.close()
     return earned_badges_list
 
-def get_all_badges_summary(user_id: int) -> str:
-    """Generates the formatted string showing earned & locked badges with progress."""
-    earned_dict = dict(get_badges(user_id))  # Create dict for quick lookup: {badge_name: date_str}
+async def get_all_badges_summary(user_id: int) -> str:
+    """
+    Generates the formatted string showing earned & locked badges with progress.
+    Rendered from the user's event counters and cached for the day; the user's
+    own log / goal events (or a new award) invalidate it.
+    """
+    today = scheduler.user_date(user_id)
+    cached = _summaries.get(user_id)
+    if cached and cached[0] == today:
+        _event_stats["summary_hits"] += 1
+        return cached[1]
+    _event_stats["summary_misses"] += 1
+
+    earned_dict = dict(await get_badges(user_id))  # Create dict for quick lookup: {badge_name: date_str}
+    if user_id not in _counters:
+        await _load([user_id])
+    counters = _counters[user_id]
+    _roll(counters, today)
+    text = format_badges_summary(earned_dict, counters)
+    _summaries[user_id] = (today, text)
+    return text
+
+def invalidate_summary(user_id: int):
+    _summaries.pop(user_id, None)
+
+def format_badges_summary(earned_dict: dict[str, str], stats: dict) -> str:
     lines = ["🏅 **Your Badge Progress:**\n"]
 
     for badge in BADGE_DEFINITIONS:
         name = badge["name"]
         desc = badge["desc"]
-        progress_func = badge["progress"] # Get the lambda function
+        progress_func = badge["progress"]
 
         if name in earned_dict:
             earned_date = earned_dict[name]
@@ -187,10 +377,9 @@ def get_all_badges_summary(user_id: int) -> str:
         else:
             # Show Locked Badge with Progress
             try:
-                # Call the lambda function to get progress string
-                progress_str = progress_func(user_id)
+                progress_str = progress_func(stats)
             except Exception as e:
-                logger.error(f"Error getting progress for badge '{name}', user {user_id}: {e}")
+                logger.error(f"Error getting progress for badge '{name}': {e}")
                 progress_str = "Error calculating"
             lines.append(f"🔒 {name} — _{desc}_\n📈 Progress: {progress_str}\n")
 
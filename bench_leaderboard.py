@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+bench_leaderboard.py
+
+Measures /leaderboard query latency against the old daily_track layout
+(TEXT date, primary key only) and the migrated one (DATE column plus the
+(date, done DESC) INCLUDE (user_id, goal) covering index).
+
+Both layouts are built side by side in a scratch `bench` schema so your real
+tables are never touched. Seeding is done server-side with generate_series.
+
+Usage:
+    python bench_leaderboard.py                       # 100k users x 365 days
+    python bench_leaderboard.py --users 10000 --days 90 --runs 50
+    python bench_leaderboard.py --keep                # leave the bench schema in place
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import date, timedelta
+
+import asyncpg
+
+from db import DATABASE_URL
+
+LEADERBOARD_SQL = """
+    SELECT u.user_id,
+           COALESCE(NULLIF(u.username, ''), u.first_name) AS display_name,
+           dt.done
+    FROM {table} dt
+    JOIN bench.users u ON u.user_id = dt.user_id
+    WHERE dt.date = $1 AND dt.done > 0
+    ORDER BY dt.done DESC
+    LIMIT 5;
+"""
+
+async def seed(conn, users: int, days: int):
+    print(f"→ Seeding {users:,} users × {days} days ({users * days:,} rows per layout)...")
+    await conn.execute("DROP SCHEMA IF EXISTS bench CASCADE; CREATE SCHEMA bench;")
+    await conn.execute(
+        """
+        CREATE TABLE bench.users (user_id BIGINT PRIMARY KEY, username TEXT, first_name TEXT);
+        CREATE TABLE bench.daily_track_text (
+          user_id BIGINT, date TEXT, goal INTEGER DEFAULT 0, done INTEGER DEFAULT 0,
+          PRIMARY KEY(user_id, date)
+        );
+        CREATE TABLE bench.daily_track_date (
+          user_id BIGINT, date DATE, goal INTEGER DEFAULT 0, done INTEGER DEFAULT 0,
+          PRIMARY KEY(user_id, date)
+        );
+        """
+    )
+    await conn.execute(
+        "INSERT INTO bench.users SELECT g, 'user' || g, 'User' || g FROM generate_series(1, $1) g",
+        users
+    )
+    await conn.execute(
+        """
+        INSERT INTO bench.daily_track_date (user_id, date, goal, done)
+        SELECT u, CURRENT_DATE - d, 5 + (u % 6), floor(random() * 12)::int
+        FROM generate_series(1, $1) u, generate_series(0, $2 - 1) d
+        """,
+        users, days
+    )
+    await conn.execute(
+        """
+        INSERT INTO bench.daily_track_text (user_id, date, goal, done)
+        SELECT user_id, to_char(date, 'YYYY-MM-DD'), goal, done FROM bench.daily_track_date
+        """
+    )
+    await conn.execute(
+        "CREATE INDEX ON bench.daily_track_date (date, done DESC) INCLUDE (user_id, goal)"
+    )
+    await conn.execute("VACUUM ANALYZE bench.users")
+    await conn.execute("VACUUM ANALYZE bench.daily_track_text")
+    await conn.execute("VACUUM ANALYZE bench.daily_track_date")
+
+async def time_query(conn, table: str, param, runs: int) -> list[float]:
+    sql = LEADERBOARD_SQL.format(table=table)
+    await conn.fetch(sql, param)  # warm-up
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await conn.fetch(sql, param)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+def report(label: str, timings: list[float]):
+    timings = sorted(timings)
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(
+        f"{label:<32} p50 {statistics.median(timings):9.2f} ms   "
+        f"p95 {p95:9.2f} ms   max {timings[-1]:9.2f} ms"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse an existing bench schema")
+    parser.add_argument("--keep", action="store_true", help="don't drop the bench schema afterwards")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        if not args.skip_seed:
+            await seed(conn, args.users, args.days)
+        # Query a day in the middle of the range, not just today
+        day = date.today() - timedelta(days=args.days // 2)
+        before = await time_query(conn, "bench.daily_track_text", day.isoformat(), args.runs)
+        after = await time_query(conn, "bench.daily_track_date", day, args.runs)
+        print(f"\n📊 Leaderboard latency ({args.users:,} users × {args.days} days, {args.runs} runs)")
+        report("before: TEXT date, PK only", before)
+        report("after: DATE + covering index", after)
+        print(f"\nSpeed-up (p50): {statistics.median(before) / statistics.median(after):.1f}×")
+    finally:
+        if not args.keep:
+            await conn.execute("DROP SCHEMA IF EXISTS bench CASCADE")
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
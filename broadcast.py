@@ -0,0 +1,155 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_GLOBAL_RATE = float(os.getenv("BROADCAST_GLOBAL_RATE", "30"))     # msgs/sec, whole bot
+BROADCAST_PER_CHAT_RATE = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))  # msgs/sec, one chat
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+
+# =========================================
+# Token bucket
+# =========================================
+class TokenBucket:
+    """Async token bucket: `await bucket.take()` waits until a token is free."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def take(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Shared by every broadcast so reminders and wrap-ups don't add up past Telegram's limit
+_global_bucket: TokenBucket | None = None
+
+def _get_global_bucket() -> TokenBucket:
+    global _global_bucket
+    if _global_bucket is None:
+        _global_bucket = TokenBucket(BROADCAST_GLOBAL_RATE)
+    return _global_bucket
+
+# =========================================
+# Messages and report
+# =========================================
+@dataclass
+class Outgoing:
+    """One delivery to a chat: optional text, then optional animation."""
+    chat_id: int
+    text: str | None = None
+    animation: str | None = None
+
+@dataclass
+class BroadcastReport:
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    blocked: set[int] = field(default_factory=set)
+    errors: dict[int, str] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"sent={self.sent} failed={self.failed} blocked={len(self.blocked)} "
+            f"retries={self.retries} in {self.elapsed:.1f}s ({self.throughput:.1f} msg/s)"
+        )
+
+# =========================================
+# Broadcast
+# =========================================
+async def broadcast(bot, outgoing: list[Outgoing], label: str = "broadcast",
+                    skip: set[int] | None = None) -> BroadcastReport:
+    """
+    Deliver `outgoing` with bounded concurrency under the global and per-chat rate limits.
+    Messages for the same chat keep their order. Chats that have blocked the bot
+    (Forbidden) are dropped for the rest of the run and listed in `report.blocked`;
+    chats in `skip` are not contacted at all.
+    """
+    report = BroadcastReport()
+    skip = skip or set()
+    by_chat: dict[int, list[Outgoing]] = {}
+    for item in outgoing:
+        if item.chat_id not in skip:
+            by_chat.setdefault(item.chat_id, []).append(item)
+
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    started = time.monotonic()
+
+    async def deliver_chat(chat_id: int, items: list[Outgoing]):
+        async with semaphore:
+            chat_bucket = TokenBucket(BROADCAST_PER_CHAT_RATE)
+            for item in items:
+                calls = []
+                if item.text:
+                    calls.append(lambda item=item: bot.send_message(chat_id=chat_id, text=item.text))
+                if item.animation:
+                    calls.append(lambda item=item: bot.send_animation(chat_id=chat_id, animation=item.animation))
+                for call in calls:
+                    if not await _send(call, chat_id, chat_bucket, report):
+                        return
+
+    await asyncio.gather(*(deliver_chat(cid, items) for cid, items in by_chat.items()))
+    report.elapsed = time.monotonic() - started
+    logger.info(f"📣 {label}: {report.summary()}")
+    if report.blocked:
+        logger.info(f"📣 {label}: dropped {len(report.blocked)} chats that blocked the bot")
+    return report
+
+async def _send(call, chat_id: int, chat_bucket: TokenBucket, report: BroadcastReport) -> bool:
+    """Send one message with retries. Returns False when the chat should be dropped."""
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        last_attempt = attempt == BROADCAST_MAX_RETRIES
+        await chat_bucket.take()
+        await _get_global_bucket().take()
+        try:
+            await call()
+            report.sent += 1
+            return True
+        except RetryAfter as e:
+            logger.warning(f"Flood limit hit for chat {chat_id}, retry_after={e.retry_after}s")
+            delay = e.retry_after
+        except Forbidden:
+            report.blocked.add(chat_id)
+            return False
+        except BadRequest as e:
+            # Permanent (chat not found, bad animation URL...); BadRequest subclasses NetworkError
+            report.failed += 1
+            report.errors[chat_id] = str(e)
+            logger.error(f"Failed to send to {chat_id}: {e}")
+            return True
+        except (TimedOut, NetworkError) as e:
+            logger.warning(f"Network error sending to {chat_id}: {e}")
+            delay = 2 ** attempt
+        except Exception as e:
+            report.failed += 1
+            report.errors[chat_id] = str(e)
+            logger.error(f"Failed to send to {chat_id}: {e}")
+            return True
+        if last_attempt:
+            break
+        report.retries += 1
+        await asyncio.sleep(delay)
+    report.failed += 1
+    report.errors[chat_id] = "retries exhausted"
+    return True
@@ -1,45 +1,56 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
-from telegram.ext import CommandHandler, CallbackContext, CallbackQueryHandler
-from datetime import datetime, timedelta
-import sqlite3
-import requests
-from config import OPENROUTER_API_KEY
-
-WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-
-def coachsummary(update: Update, context: CallbackContext):
-    user_id = update.effective_chat.id
-    today = datetime.now()
-    start_of_week = today - timedelta(days=today.weekday())
-    this_week = [start_of_week + timedelta(days=i) for i in range(7)]
-    weekday_map = {d.strftime("%A"): d.strftime("%Y-%m-%d") for d in this_week}
-
-    try:
-        conn = sqlite3.connect("jobpal.db")
-        c = conn.cursor()
-        c.execute("SELECT weekday, goal_count FROM user_goals WHERE user_id = ?", (user_id,))
-        goals = dict(c.fetchall())
-
-        applied = {}
-        for weekday, date_str in weekday_map.items():
-            c.execute("SELECT count_applied FROM user_progress WHERE user_id = ? AND date = ?", (user_id, date_str))
-            row = c.fetchone()
-            applied[weekday] = row[0] if row else 0
-
-    except Exception as e:
-        print("Database error:", e)
-        update.message.reply_text("❌ Couldn't load your weekly data.")
-        return
-    finally:
-        conn.close()
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CommandHandler, ContextTypes, CallbackQueryHandler
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
+from datetime import date, time, timedelta
+from zoneinfo import ZoneInfo
+import os
+import asyncio
+import logging
+from db import acquire, DEFAULT_TIMEZONE
+from goal_command import fetch_history, progress
+import llm_gateway
+import today_cache
+import rollups
+
+logger = logging.getLogger(__name__)
+
+COACH_MODEL = "mistralai/mistral-7b-instruct"
+# Overnight precompute of every active user's review (local time of DEFAULT_TIMEZONE)
+COACH_BATCH_HOUR = int(os.getenv("COACH_BATCH_HOUR", "3"))
+COACH_BATCH_CONCURRENCY = int(os.getenv("COACH_BATCH_CONCURRENCY", "5"))
+
+# (user_id, iso_year, iso_week) -> rendered review; backed by the coach_reviews table
+_reviews: dict[tuple[int, int, int], str] = {}
+_stats = {"served_stored": 0, "generated_live": 0, "last_batch": None}
+
+_UPSERT_REVIEW_SQL = """
+INSERT INTO coach_reviews (user_id, iso_year, iso_week, content) VALUES ($1, $2, $3, $4)
+ON CONFLICT (user_id, iso_year, iso_week)
+DO UPDATE SET content = EXCLUDED.content, generated_at = CURRENT_TIMESTAMP
+"""
 
-    total_goal = sum(goals.get(day, 0) for day in WEEKDAYS)
-    total_done = sum(applied.get(day, 0) for day in WEEKDAYS)
+# =========================================
+# Review data
+# =========================================
+def review_week(today: date) -> tuple[date, date]:
+    """
+    Monday..Sunday of the week under review: the current ISO week, except on
+    Mondays, when the week that just ended is the one worth reviewing.
+    """
+    if today.weekday() == 0:
+        today -= timedelta(days=1)
+    start = today - timedelta(days=today.weekday())
+    return start, start + timedelta(days=6)
+
+def build_coach_prompt(history: list[tuple[date, int, int]], totals: dict) -> tuple[str, int, int, float]:
+    total_goal = sum(g for _, g, _ in history)
+    total_done = sum(dn for _, _, dn in history)
     percent = round((total_done / total_goal * 100), 1) if total_goal else 0
 
     stats_text = "\n".join([
-        f"{day}: Goal {goals.get(day, 0)} | Applied {applied.get(day, 0)}"
-        for day in WEEKDAYS
+        f"{d.strftime('%A')}: Goal {g} | Applied {dn}"
+        for d, g, dn in history
     ])
 
     coach_prompt = f"""
@@ -55,62 +66,175 @@ Completion Rate: {percent}%
 
 Day-by-day breakdown:
 {stats_text}
-"""
 
-    llm_message = get_llm_feedback(coach_prompt)
+All-time record:
+Total Applied: {totals['done_sum']}
+Days Goal Met: {totals['days_met']}
+Best Streak: {totals['longest_streak']} days
+"""
+    return coach_prompt, total_goal, total_done, percent
 
-    update.message.reply_text(
+async def get_llm_feedback(prompt: str) -> str:
+    messages = [
+        {"role": "system", "content": "You are a tough love career coach."},
+        {"role": "user", "content": prompt.strip()}
+    ]
+    return await llm_gateway.complete(messages, site="coach", model=COACH_MODEL)
+
+async def generate_review(user_id: int, start: date, end: date) -> str:
+    """
+    One week range query, the lifetime totals (see rollups.get_totals) and one
+    LLM call; raises if the coach can't be reached.
+    """
+    history = await fetch_history(user_id, start, end)
+    totals = await rollups.get_totals(user_id)
+    coach_prompt, total_goal, total_done, percent = build_coach_prompt(history, totals)
+    llm_message = await get_llm_feedback(coach_prompt)
+    return (
         f"⚠️ *Coach Mode Activated*\n"
         f"This is blunt feedback meant to push you.\n\n"
         f"📊 Weekly Total: {total_done}/{total_goal} ({percent}%)\n\n"
-        f"🧠 Coach says:\n{llm_message}",
-        parse_mode="Markdown"
+        # The model's own * and _ would break the Markdown of a review cached all week
+        f"🧠 Coach says:\n{escape_markdown(llm_message)}"
     )
 
-def get_llm_feedback(prompt: str) -> str:
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "mistralai/mistral-7b-instruct",
-        "messages": [
-            {"role": "system", "content": "You are a tough love career coach."},
-            {"role": "user", "content": prompt.strip()}
-        ]
+# =========================================
+# Review cache (per user per ISO week)
+# =========================================
+async def load_review(user_id: int, iso_year: int, iso_week: int) -> str | None:
+    key = (user_id, iso_year, iso_week)
+    if key in _reviews:
+        return _reviews[key]
+    async with acquire() as conn:
+        content = await conn.fetchval(
+            "SELECT content FROM coach_reviews WHERE user_id = $1 AND iso_year = $2 AND iso_week = $3",
+            user_id, iso_year, iso_week
+        )
+    if content is not None:
+        _reviews[key] = content
+    return content
+
+async def store_review(user_id: int, iso_year: int, iso_week: int, content: str):
+    async with acquire() as conn:
+        await conn.execute(
+            _UPSERT_REVIEW_SQL, user_id, iso_year, iso_week, content
+        )
+    _reviews[(user_id, iso_year, iso_week)] = content
+
+async def get_weekly_review(user_id: int) -> str:
+    """The stored review for this user's review week; generated live only on a miss."""
+    start, end = review_week(date.today())
+    iso_year, iso_week, _ = start.isocalendar()
+    review = await load_review(user_id, iso_year, iso_week)
+    if review is not None:
+        _stats["served_stored"] += 1
+        return review
+    # Not precomputed (new user, or first active after the batch ran)
+    _stats["generated_live"] += 1
+    review = await generate_review(user_id, start, end)
+    await store_review(user_id, iso_year, iso_week, review)
+    return review
+
+# =========================================
+# Overnight batch
+# =========================================
+async def precompute_reviews(context: ContextTypes.DEFAULT_TYPE | None = None) -> dict:
+    """
+    Regenerate the review-week review of every user who logged that week,
+    at most COACH_BATCH_CONCURRENCY LLM calls at a time, and store them all
+    in one batch. Failed users keep their previous review (or get a live one on request).
+    """
+    started = asyncio.get_running_loop().time()
+    await today_cache.flush()
+    start, end = review_week(date.today())
+    iso_year, iso_week, _ = start.isocalendar()
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT DISTINCT user_id FROM daily_track WHERE date BETWEEN $1 AND $2 AND done > 0",
+            start, end
+        )
+    user_ids = [r["user_id"] for r in rows]
+    semaphore = asyncio.Semaphore(COACH_BATCH_CONCURRENCY)
+
+    async def generate(user_id: int) -> str | None:
+        async with semaphore:
+            try:
+                return await generate_review(user_id, start, end)
+            except Exception as e:
+                logger.warning(f"Coach batch: review for {user_id} failed: {e!r}")
+                return None
+
+    reviews = await asyncio.gather(*(generate(uid) for uid in user_ids))
+    records = [(uid, iso_year, iso_week, review) for uid, review in zip(user_ids, reviews) if review]
+    if records:
+        async with acquire() as conn:
+            await conn.executemany(
+                _UPSERT_REVIEW_SQL, records
+            )
+    # Only the review week's entries can still be served from memory
+    for key in [key for key in _reviews if key[1:] != (iso_year, iso_week)]:
+        del _reviews[key]
+    for uid, y, w, review in records:
+        _reviews[(uid, y, w)] = review
+
+    report = {
+        "week": f"{iso_year}-W{iso_week:02d}",
+        "users": len(user_ids),
+        "stored": len(records),
+        "failed": len(user_ids) - len(records),
+        "elapsed_s": round(asyncio.get_running_loop().time() - started, 1),
     }
+    _stats["last_batch"] = report
+    logger.info(f"🧠 Coach batch {report['week']}: {report['stored']}/{report['users']} reviews stored "
+                f"in {report['elapsed_s']}s ({report['failed']} failed)")
+    return report
+
+def schedule_review_batch(job_queue):
+    job_queue.run_daily(
+        precompute_reviews,
+        time=time(hour=COACH_BATCH_HOUR, tzinfo=ZoneInfo(DEFAULT_TIMEZONE)),
+        name="coach-review-batch",
+    )
+
+def get_stats() -> dict:
+    return {**_stats, "cached": len(_reviews)}
+
+# =========================================
+# Handlers
+# =========================================
+async def coachsummary(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
     try:
-        response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=data)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"].strip()
+        review = await get_weekly_review(user_id)
     except Exception as e:
-        print("Coach LLM error:", e)
-        return "(⚠️ Error fetching coach feedback.)"
+        logger.error(f"Coach review failed for user {user_id}: {e}")
+        await update.effective_message.reply_text("(⚠️ Error fetching coach feedback.)")
+        return
+    try:
+        await update.effective_message.reply_text(review, parse_mode="Markdown")
+    except BadRequest as e:
+        # Reviews stored before escaping may still hold unbalanced markup
+        logger.warning(f"Coach review for {user_id} failed to parse, sending as plain text: {e}")
+        await update.effective_message.reply_text(review)
 
-def ask_weekly_summary(update: Update, context: CallbackContext):
+async def ask_weekly_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("✅ Regular Summary", callback_data="summary_choice")],
         [InlineKeyboardButton("🧠 Coach Summary (tough love)", callback_data="coach_choice")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    update.message.reply_text("How would you like your weekly summary?", reply_markup=reply_markup)
+    await update.message.reply_text("How would you like your weekly summary?", reply_markup=reply_markup)
 
-def handle_summary_choice(update: Update, context: CallbackContext):
+async def handle_summary_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    query.answer()
+    await query.answer()
     choice = query.data
 
-    # Use original message’s chat to get message object safely
-    message: Message = query.message
-
-    # Create a dummy Update for compatibility
-    dummy_update = Update(update.update_id, message=message)
-
     if choice == "summary_choice":
-        from goal_command import summary
-        summary(dummy_update, context)
+        # The regular summary is this week's /progress
+        await progress(update, context)
     elif choice == "coach_choice":
-        coachsummary(dummy_update, context)
+        await coachsummary(update, context)
 
 def get_coachsummary_handler():
     return [
@@ -0,0 +1,130 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import httpx
+from config import GIPHY_API_KEY
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+GIPHY_ENDPOINT = "https://api.giphy.com/v1/gifs/random"
+FALLBACK_GIF_URL = "https://media.giphy.com/media/JIX9t2j0ZTN9S/giphy.gif"
+GIF_POOL_SIZE = int(os.getenv("GIF_POOL_SIZE", "8"))           # URLs kept per tag
+GIF_TTL_SECONDS = int(os.getenv("GIF_TTL_SECONDS", "21600"))    # evict after 6h
+GIF_FETCH_TIMEOUT = float(os.getenv("GIF_FETCH_TIMEOUT", "5"))
+# After a refill that failed or came back short, wait this long (doubling, capped) before the next
+GIF_REFILL_BACKOFF_SECONDS = float(os.getenv("GIF_REFILL_BACKOFF_SECONDS", "60"))
+GIF_REFILL_MAX_BACKOFF_SECONDS = float(os.getenv("GIF_REFILL_MAX_BACKOFF_SECONDS", "3600"))
+
+# (tag, rating) -> list of (url, fetched_at)
+_pools: dict[tuple[str, str], list[tuple[str, float]]] = {}
+_refills: dict[tuple[str, str], asyncio.Task] = {}
+# (tag, rating) -> (monotonic time before which no refill starts, consecutive short refills)
+_backoff: dict[tuple[str, str], tuple[float, int]] = {}
+_client: httpx.AsyncClient | None = None
+_stats = {"hits": 0, "misses": 0, "fetches": 0, "fetch_errors": 0, "refills_deferred": 0}
+
+# =========================================
+# Public API
+# =========================================
+def get_gif(tag: str, rating: str = "pg") -> str:
+    """
+    Return a GIF URL for `tag` immediately from the local pool.
+    Never waits on Giphy: on a cold or expired pool it returns the fallback URL
+    and refills the pool in the background.
+    """
+    key = (tag, rating)
+    pool = _evict_expired(key)
+    if len(pool) < GIF_POOL_SIZE:
+        _schedule_refill(key)
+    if pool:
+        _stats["hits"] += 1
+        return random.choice(pool)[0]
+    _stats["misses"] += 1
+    return FALLBACK_GIF_URL
+
+def prefetch(tag: str, rating: str = "pg"):
+    """Warm the pool for a tag so the first handler call is already a hit."""
+    _schedule_refill((tag, rating))
+
+async def aclose():
+    """Cancel pending refills and close the shared HTTP client (call on shutdown)."""
+    global _client
+    for task in _refills.values():
+        task.cancel()
+    _refills.clear()
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def get_stats() -> dict:
+    """Pool sizes and hit/miss counters for monitoring."""
+    return {
+        **_stats,
+        "pools": {f"{tag} ({rating})": len(pool) for (tag, rating), pool in _pools.items()},
+    }
+
+# =========================================
+# Internals
+# =========================================
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=GIF_FETCH_TIMEOUT)
+    return _client
+
+def _evict_expired(key) -> list[tuple[str, float]]:
+    cutoff = time.monotonic() - GIF_TTL_SECONDS
+    pool = [entry for entry in _pools.get(key, []) if entry[1] >= cutoff]
+    _pools[key] = pool
+    return pool
+
+def _schedule_refill(key):
+    if not GIPHY_API_KEY:
+        return
+    task = _refills.get(key)
+    if task and not task.done():
+        return
+    if time.monotonic() < _backoff.get(key, (0.0, 0))[0]:
+        _stats["refills_deferred"] += 1
+        return
+    _refills[key] = asyncio.get_running_loop().create_task(_refill(key))
+
+async def _refill(key):
+    tag, rating = key
+    missing = GIF_POOL_SIZE - len(_evict_expired(key))
+    if missing <= 0:
+        return
+    urls = await asyncio.gather(*(_fetch_one(tag, rating) for _ in range(missing)))
+    now = time.monotonic()
+    pool = _pools.setdefault(key, [])
+    known = {url for url, _ in pool}
+    for url in urls:
+        if url and url not in known:
+            pool.append((url, now))
+            known.add(url)
+    if len(pool) < GIF_POOL_SIZE:
+        # Giphy failing, or the tag has too few distinct GIFs: don't re-fire on every call
+        strikes = _backoff.get(key, (0.0, 0))[1] + 1
+        delay = min(GIF_REFILL_BACKOFF_SECONDS * 2 ** (strikes - 1), GIF_REFILL_MAX_BACKOFF_SECONDS)
+        _backoff[key] = (now + delay, strikes)
+        logger.info(f"GIF pool '{tag}' short ({len(pool)}/{GIF_POOL_SIZE}), next refill in {delay:.0f}s")
+    else:
+        _backoff.pop(key, None)
+
+async def _fetch_one(tag: str, rating: str) -> str | None:
+    _stats["fetches"] += 1
+    try:
+        resp = await _get_client().get(
+            GIPHY_ENDPOINT,
+            params={"api_key": GIPHY_API_KEY, "tag": tag, "rating": rating},
+        )
+        resp.raise_for_status()
+        data = resp.json().get("data", {})
+        return data.get("images", {}).get("original", {}).get("url")
+    except Exception as e:
+        _stats["fetch_errors"] += 1
+        logger.warning(f"Giphy API error for tag '{tag}': {e}")
+        return None
@@ -1,12 +1,15 @@
 import logging
 import os
-import requests
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
 from dotenv import load_dotenv
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import CommandHandler, CallbackQueryHandler, ConversationHandler, ContextTypes
-from config import GIPHY_API_KEY
-from db import get_pg_conn as get_db_connection
+from db import acquire
+import gif_service
+import today_cache
+import rollups
+import scheduler
+import badge_utils
 
 logger = logging.getLogger(__name__)
 load_dotenv()
@@ -20,62 +23,81 @@ BUTTON_STEPS = [5, 10, 15]
 LOG_PREFIX = "logjob_"
 LOG_DONE = "done"
 CANCEL = "cancel"
+LOG_GIF_TAG = "hustle cat"
+MAX_PROGRESS_DAYS = 90
 
 # =========================================
 # Database Helpers
 # =========================================
 async def get_or_create_today(user_id: int) -> tuple[int, int]:
-    today = date.today().isoformat()
-    conn = await get_db_connection()
-    row = await conn.fetchrow(
-        "SELECT goal, done FROM daily_track WHERE user_id=$1 AND date=$2", user_id, today
-    )
-    if row:
-        await conn.close()
-        return row['goal'], row['done']
-    last = await conn.fetchrow(
-        "SELECT goal FROM daily_track WHERE user_id=$1 ORDER BY date DESC LIMIT 1", user_id
-    )
-    goal = last['goal'] if last else 0
-    done = 0
-    await conn.execute(
-        "INSERT INTO daily_track (user_id, date, goal, done) VALUES ($1, $2, $3, $4)",
-        user_id, today, goal, done
-    )
-    await conn.close()
-    return goal, done
-
-async def set_goal(user_id: int, new_goal: int):
-    today = date.today().isoformat()
-    conn = await get_db_connection()
-    done_row = await conn.fetchrow(
-        "SELECT done FROM daily_track WHERE user_id=$1 AND date=$2", user_id, today
-    )
-    done = done_row['done'] if done_row else 0
-    await conn.execute(
-        "INSERT INTO daily_track (user_id, date, goal, done) VALUES ($1, $2, $3, $4) "
-        "ON CONFLICT (user_id, date) DO UPDATE SET goal = EXCLUDED.goal, done = EXCLUDED.done",
-        user_id, today, new_goal, done
-    )
-    await conn.close()
+    return await today_cache.get(user_id)
+
+async def set_goal(user_id: int, new_goal: int) -> tuple[int, int]:
+    return await today_cache.set_goal(user_id, new_goal)
 
 async def fetch_count(user_id: int) -> int:
     _, done = await get_or_create_today(user_id)
     return done
 
 async def update_count(user_id: int, new_done: int):
-    today = date.today().isoformat()
-    conn = await get_db_connection()
-    goal_row = await conn.fetchrow(
-        "SELECT goal FROM daily_track WHERE user_id=$1 AND date=$2", user_id, today
-    )
-    goal = goal_row['goal'] if goal_row else 0
-    await conn.execute(
-        "INSERT INTO daily_track (user_id, date, goal, done) VALUES ($1, $2, $3, $4) "
-        "ON CONFLICT (user_id, date) DO UPDATE SET done = EXCLUDED.done",
-        user_id, today, goal, new_done
-    )
-    await conn.close()
+    await today_cache.set_done(user_id, new_done)
+
+async def increment_count(user_id: int, n: int = 1) -> tuple[int, int]:
+    """
+    Add `n` to today's count and return (goal, done).
+    Absorbed by the in-memory today cache and written back in the next batch flush.
+    """
+    return await today_cache.increment(user_id, n)
+
+async def fetch_history(user_id: int, start: date, end: date) -> list[tuple[date, int, int]]:
+    """
+    Return [(day, goal, done)] for every day in start..end (inclusive) with one
+    range query. Days without a row are filled in as (0, 0); today's values
+    come from the write-behind cache when it has them.
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT date, goal, done FROM daily_track WHERE user_id=$1 AND date BETWEEN $2 AND $3",
+            user_id, start, end
+        )
+    by_day = {r['date']: (r['goal'], r['done']) for r in rows}
+    today = scheduler.user_date(user_id)
+    if start <= today <= end:
+        cached = today_cache.peek(user_id)
+        if cached:
+            by_day[today] = cached
+    days = (end - start).days + 1
+    return [
+        (d, *by_day.get(d, (0, 0)))
+        for d in (start + timedelta(days=i) for i in range(days))
+    ]
+
+async def emit_badge_event(bot, event: str, user_id: int, goal: int, done: int, n: int = 0):
+    """Feed a badge event and tell the user about any badge it unlocked."""
+    try:
+        new_badges = await badge_utils.emit(event, user_id, goal, done, n)
+        if new_badges:
+            await bot.send_message(chat_id=user_id, text=badge_utils.format_new_badges(new_badges))
+    except Exception as e:
+        logger.error(f"Badge event {event} failed for user {user_id}: {e}")
+
+def resolve_range(period: str, today: date) -> tuple[date, date, str] | None:
+    """
+    Map a /progress argument to (start, end, title):
+    'week' = this Monday..Sunday, 'month' = this calendar month,
+    'N' = the last N days ending today. Returns None for anything else.
+    """
+    if period == "week":
+        start = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=6), "Weekly Progress"
+    if period == "month":
+        start = today.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1), f"{today.strftime('%B')} Progress"
+    if period.isdigit() and 1 <= int(period) <= MAX_PROGRESS_DAYS:
+        days = int(period)
+        return today - timedelta(days=days - 1), today, f"Last {days} Days"
+    return None
 
 # =========================================
 # Cancel Handler
@@ -115,8 +137,9 @@ async def handle_setgoal_choice(update: Update, context: ContextTypes.DEFAULT_TY
         # Cancel
         await q.edit_message_text("❌ Goal setting cancelled.")
         return ConversationHandler.END
-    await set_goal(user_id, new_goal)
+    goal, done = await set_goal(user_id, new_goal)
     await q.edit_message_text(f"✅ Daily goal set to *{new_goal}*!", parse_mode="Markdown")
+    await emit_badge_event(context.bot, "goal_set", user_id, goal, done)
     return ConversationHandler.END
 
 def get_setgoal_handler() -> ConversationHandler:
@@ -158,27 +181,15 @@ async def log_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     action = q.data
     logger.info(f"log_button triggered for user {user_id} with action {action}")
     if action == f"{LOG_PREFIX}inc":
-        done = await fetch_count(user_id) + 1
-        await update_count(user_id, done)
-        goal, _ = await get_or_create_today(user_id)
+        goal, done = await increment_count(user_id)
         await q.edit_message_text(build_log_ui(done, goal), reply_markup=q.message.reply_markup)
+        await emit_badge_event(context.bot, "job_logged", user_id, goal, done, n=1)
         return LOGGING
     if action == f"{LOG_PREFIX}{LOG_DONE}":
         await q.edit_message_text('🎉 Logged! Great work today.', reply_markup=None)
-        # Send celebratory GIF if available
-        try:
-            resp = requests.get(
-                'https://api.giphy.com/v1/gifs/random',
-                params={'api_key': GIPHY_API_KEY, 'tag': 'hustle cat', 'rating': 'pg'},
-                timeout=5
-            )
-            data = resp.json().get('data', {})
-            gif_url = data.get('images', {}).get('original', {}).get('url')
-        except Exception as e:
-            logger.warning(f"Giphy API error: {e}")
-            gif_url = None
-        if gif_url:
-            await context.bot.send_animation(chat_id=user_id, animation=gif_url)
+        # Send celebratory GIF (served from the local pool, never waits on Giphy)
+        gif_url = gif_service.get_gif(LOG_GIF_TAG)
+        await context.bot.send_animation(chat_id=user_id, animation=gif_url)
         # After celebrating, offer to return home
         await context.bot.send_message(
             chat_id=user_id,
@@ -205,39 +216,73 @@ def get_logjobs_handler() -> ConversationHandler:
 # /progress Command
 # =========================================
 async def progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /progress [week|month|year|N] — one range query, however long the window.
+    Also answers button taps (no args = this week), so it replies via effective_message.
+    """
     user_id = update.effective_user.id
-    today_date = datetime.now().date()
-    start_week = today_date - timedelta(days=today_date.weekday())
-    week_dates = [(start_week + timedelta(days=i)).isoformat() for i in range(7)]
+    today_date = scheduler.user_date(user_id)
+    period = context.args[0].lower() if context.args else "week"
+    if period == "year":
+        await progress_year(update, user_id)
+        return
+    resolved = resolve_range(period, today_date)
+    if resolved is None:
+        await update.effective_message.reply_text(
+            f"❓ Usage: /progress [week|month|year|N] (N = 1–{MAX_PROGRESS_DAYS} days)"
+        )
+        return
+    start, end, title = resolved
+    history = await fetch_history(user_id, start, end)
 
-    conn = await get_db_connection()
     lines = []
     total_goal = total_done = streak = 0
     on_streak = True
-    for d in week_dates:
-        row = await conn.fetchrow(
-            "SELECT goal, done FROM daily_track WHERE user_id=$1 AND date=$2", user_id, d
-        )
-        g, dn = (row['goal'], row['done']) if row else (0, 0)
+    for d, g, dn in history:
         total_goal += g
         total_done += dn
         if g and dn >= g and on_streak:
             streak += 1
         else:
             on_streak = False
-        bar = '✅' * min(dn, g) + '⬜️' * max(0, g - dn)
-        extra = f" +{dn - g} ✨" if dn > g else ''
-        day_name = datetime.fromisoformat(d).strftime('%A')
         emoji = '✅' if dn >= g else '❌'
-        lines.append(f"{emoji} {day_name}: {bar}{extra} ({dn}/{g})")
-    await conn.close()
+        if period == "week":
+            bar = '✅' * min(dn, g) + '⬜️' * max(0, g - dn)
+            extra = f" +{dn - g} ✨" if dn > g else ''
+            lines.append(f"{emoji} {d.strftime('%A')}: {bar}{extra} ({dn}/{g})")
+        else:
+            # Compact rows so a month or more still fits in one message
+            lines.append(f"{emoji} {d.strftime('%a %b %d')}: {dn}/{g}")
 
     pct = round((total_done / total_goal * 100), 1) if total_goal else 0
     streak_line = f"\n🔥 Current streak: **{streak}** day(s)!" if streak else ''
     text = (
-        '📊 **Weekly Progress**\n' +
+        f'📊 **{title}**\n' +
         '\n'.join(lines) +
         f"\n\n**Total:** {total_done}/{total_goal} ({pct}%)" +
         streak_line
     )
-    await update.message.reply_text(text, parse_mode='Markdown')
+    await update.effective_message.reply_text(text, parse_mode='Markdown')
+
+async def progress_year(update: Update, user_id: int):
+    """Last 12 months from the monthly rollups: twelve rows, no daily scan."""
+    months = await rollups.get_rollups(user_id, "month", 12)
+    if not months:
+        await update.effective_message.reply_text("📊 No history yet. Log some applications first!")
+        return
+    lines = []
+    for m in months:
+        label = date(m['k1'], m['k2'], 1).strftime('%b %Y')
+        lines.append(
+            f"📅 {label}: {m['done_sum']}/{m['goal_sum']} · "
+            f"{m['days_met']} goal day(s) · best streak {m['longest_streak']}"
+        )
+    total_goal = sum(m['goal_sum'] for m in months)
+    total_done = sum(m['done_sum'] for m in months)
+    pct = round((total_done / total_goal * 100), 1) if total_goal else 0
+    text = (
+        '📊 **Last 12 Months**\n' +
+        '\n'.join(lines) +
+        f"\n\n**Total:** {total_done}/{total_goal} ({pct}%)"
+    )
+    await update.effective_message.reply_text(text, parse_mode='Markdown')
@@ -1,12 +1,23 @@
-from flask import Flask
+from flask import Flask, jsonify
 from threading import Thread
 
 app = Flask('')
 
+# name -> zero-arg callable returning a JSON-serialisable dict
+_metrics_providers = {}
+
+def register_metrics(name, provider):
+    """Expose `provider()` under `name` on the /metrics endpoint."""
+    _metrics_providers[name] = provider
+
 @app.route('/')
 def home():
     return "I'm alive!"
 
+@app.route('/metrics')
+def metrics():
+    return jsonify({name: provider() for name, provider in _metrics_providers.items()})
+
 def run():
     app.run(host='0.0.0.0', port=8080)
 
@@ -1,51 +1,136 @@
-from telegram import Update
-from telegram.ext import ContextTypes
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, CallbackQueryHandler
+import os
 import logging
-from datetime import date
-from db import get_db_connection
-from telegram import ReplyKeyboardMarkup
+from db import acquire
+import leaderboard_index
 
 logger = logging.getLogger(__name__)
 
-async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+PAGE_SIZE = 10
+LB_PREFIX = "lb"
+# Weekly/all-time boards come from materialized views refreshed this often
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv("LEADERBOARD_REFRESH_SECONDS", "300"))
+
+BOARD_TITLES = {
+    "today": "Today's Top Applicants",
+    "week": "This Week's Leaderboard",
+    "all": "All-Time Leaderboard",
+}
+BOARD_VIEWS = {
+    "week": "leaderboard_weekly_mv",
+    "all": "leaderboard_alltime_mv",
+}
+
+# =========================================
+# Board data
+# =========================================
+async def fetch_board_page(board: str, page: int, user_id: int):
     """
-    Fetch and display the top 5 users by jobs logged for today from the database.
+    Return (rows, total, me) for one page of a board, where rows are
+    [(rank, user_id, done)] and me is (rank, done) or None.
+    Today's board comes from the in-memory index; weekly and all-time boards
+    from pre-ranked materialized views, so paging never re-sorts daily_track.
     """
-    # Connect to Postgres
-    conn = await get_db_connection()
-    today_str = date.today().isoformat()
-
-    # Query top performers from Postgres
-    rows = await conn.fetch(
-        """
-        SELECT u.user_id,
-               COALESCE(NULLIF(u.username, ''), u.first_name) AS display_name,
-               dt.done
-        FROM daily_track dt
-        JOIN users u ON u.user_id = dt.user_id
-        WHERE dt.date = $1 AND dt.done > 0
-        ORDER BY dt.done DESC
-        LIMIT 5;
-        """,
-        today_str
-    )
-    await conn.close()
+    offset = page * PAGE_SIZE
+    if board == "today":
+        await leaderboard_index.ensure_fresh()
+        total = leaderboard_index.count_active()
+        rows = [
+            (leaderboard_index.rank(uid), uid, done)
+            for uid, done in leaderboard_index.page(offset, min(PAGE_SIZE, max(0, total - offset)))
+        ]
+        my_done = leaderboard_index.done_for(user_id)
+        me = (leaderboard_index.rank(user_id), my_done) if my_done else None
+        return rows, total, me
+
+    view = BOARD_VIEWS[board]
+    async with acquire() as conn:
+        page_rows = await conn.fetch(
+            f"SELECT rank, user_id, done FROM {view} WHERE pos > $1 AND pos <= $2 ORDER BY pos",
+            offset, offset + PAGE_SIZE
+        )
+        total = await conn.fetchval(f"SELECT COALESCE(MAX(pos), 0) FROM {view}")
+        mine = await conn.fetchrow(f"SELECT rank, done FROM {view} WHERE user_id = $1", user_id)
+    rows = [(r['rank'], r['user_id'], r['done']) for r in page_rows]
+    me = (mine['rank'], mine['done']) if mine else None
+    return rows, total, me
+
+async def refresh_board_views(context: ContextTypes.DEFAULT_TYPE):
+    """Re-rank the weekly and all-time boards (run periodically from the job queue)."""
+    async with acquire() as conn:
+        for view in BOARD_VIEWS.values():
+            await conn.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+
+# =========================================
+# Rendering
+# =========================================
+def render_board(board: str, page: int, rows, total: int, me) -> tuple[str, InlineKeyboardMarkup]:
+    title = BOARD_TITLES[board]
+    if board == "today":
+        title += f" ({leaderboard_index.board_day().isoformat()})"
 
-    # Build response text
     if not rows:
-        text = "📋 No one has logged jobs today yet."
+        text_lines = [f"🏆 *{title}:*", "", "📋 No one has logged jobs yet."]
     else:
-        text_lines = [f"🏆 *Today's Top Applicants ({today_str}):*", ""]
-        for rank, row in enumerate(rows, start=1):
+        text_lines = [f"🏆 *{title}:*", ""]
+        for rank, user_id, done in rows:
             medal = {1: '🥇', 2: '🥈', 3: '🥉'}.get(rank, f"{rank}.")
-            text_lines.append(f"{medal} *{row['display_name']}* — {row['done']} logged")
-        text = "\n".join(text_lines)
+            text_lines.append(f"{medal} *{leaderboard_index.display_name(user_id)}* — {done} logged")
+
+    text_lines.append("")
+    if me:
+        text_lines.append(f"📍 You: #{me[0]} of {total} ({me[1]} logged)")
+    else:
+        text_lines.append("📍 You're not on this board yet — log an application to join!")
 
-    # Include a Home button
-    home_kb = ReplyKeyboardMarkup([['🏠 Home']], resize_keyboard=True)
+    pages = max(1, -(-total // PAGE_SIZE))
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"{LB_PREFIX}:{board}:{page - 1}"))
+    nav.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"{LB_PREFIX}:{board}:{page}"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"{LB_PREFIX}:{board}:{page + 1}"))
+    switch = [
+        InlineKeyboardButton(label, callback_data=f"{LB_PREFIX}:{name}:0")
+        for name, label in (("today", "Today"), ("week", "Week"), ("all", "All-time"))
+        if name != board
+    ]
+    return "\n".join(text_lines), InlineKeyboardMarkup([nav, switch])
 
+# =========================================
+# Handlers
+# =========================================
+async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Display today's board (first page) with the caller's rank and paging buttons.
+    """
+    user_id = update.effective_user.id
+    rows, total, me = await fetch_board_page("today", 0, user_id)
+    text, keyboard = render_board("today", 0, rows, total, me)
     await update.message.reply_text(
         text,
         parse_mode="Markdown",
-        reply_markup=home_kb
+        reply_markup=keyboard
+    )
+
+async def leaderboard_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    _, board, page = q.data.split(":")
+    page = max(0, int(page))
+    rows, total, me = await fetch_board_page(board, page, q.from_user.id)
+    text, keyboard = render_board(board, page, rows, total, me)
+    try:
+        await q.edit_message_text(text, parse_mode="Markdown", reply_markup=keyboard)
+    except Exception as e:
+        # Tapping the current page button leaves the message unchanged
+        logger.debug(f"Leaderboard edit skipped: {e}")
+
+def get_leaderboard_page_handler() -> CallbackQueryHandler:
+    return CallbackQueryHandler(leaderboard_page, pattern=f"^{LB_PREFIX}:(today|week|all):\\d+$")
+
+def schedule_board_refresh(job_queue):
+    job_queue.run_repeating(
+        refresh_board_views, interval=LEADERBOARD_REFRESH_SECONDS, first=10, name="leaderboard-refresh"
     )
@@ -0,0 +1,90 @@
+import logging
+from datetime import date
+from sortedcontainers import SortedList
+from db import acquire, DEFAULT_TIMEZONE
+import today_cache
+import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Today's board (the default timezone's local day, which most rows are keyed by),
+# ordered by done DESC then user_id: entries are (-done, user_id)
+_ranked = SortedList()
+_done: dict[int, int] = {}
+_names: dict[int, str] = {}
+_day: date | None = None
+_stale = True
+
+# =========================================
+# Maintenance
+# =========================================
+async def rebuild():
+    """Reload today's board and display names from Postgres."""
+    global _ranked, _day, _stale
+    today = board_day()
+    async with acquire() as conn:
+        rows = await conn.fetch("SELECT user_id, done FROM daily_track WHERE date = $1", today)
+        names = await conn.fetch(
+            "SELECT user_id, COALESCE(NULLIF(username, ''), first_name) AS display_name FROM users"
+        )
+    _done.clear()
+    _done.update({r['user_id']: r['done'] for r in rows})
+    _ranked = SortedList((-done, uid) for uid, done in _done.items())
+    _names.clear()
+    _names.update({r['user_id']: r['display_name'] for r in names if r['display_name']})
+    _day = today
+    _stale = False
+    logger.info(f"Leaderboard index rebuilt for {today}: {len(_done)} entries")
+
+async def ensure_fresh():
+    """Rebuild on first use and after the date changes (unflushed counts are flushed first)."""
+    if _stale or _day != board_day():
+        await today_cache.flush()
+        await rebuild()
+
+def update(user_id: int, done: int, day: date):
+    """Record a user's new count for `day` (called on every daily_track write)."""
+    if day != _day:
+        # Another zone's local day, or a new board day that ensure_fresh rebuilds for
+        return
+    old = _done.get(user_id)
+    if old == done:
+        return
+    if old is not None:
+        _ranked.remove((-old, user_id))
+    _ranked.add((-done, user_id))
+    _done[user_id] = done
+
+def board_day() -> date:
+    """The day today's board covers: the local date in DEFAULT_TIMEZONE."""
+    return scheduler.local_date(DEFAULT_TIMEZONE)
+
+def set_name(user_id: int, name: str):
+    if name:
+        _names[user_id] = name
+
+# =========================================
+# Queries (O(log n), no Postgres)
+# =========================================
+def display_name(user_id: int) -> str:
+    return _names.get(user_id, str(user_id))
+
+def page(offset: int, limit: int) -> list[tuple[int, int]]:
+    return [(uid, -neg_done) for neg_done, uid in _ranked.islice(offset, offset + limit)]
+
+def rank(user_id: int) -> int | None:
+    """1-based rank (ties share a rank), or None if the user has no row today."""
+    done = _done.get(user_id)
+    if done is None:
+        return None
+    return _ranked.bisect_left((-done,)) + 1
+
+def count_active() -> int:
+    """How many users have logged at least one application today."""
+    return _ranked.bisect_left((0,))
+
+def done_for(user_id: int) -> int | None:
+    return _done.get(user_id)
+
+def get_stats() -> dict:
+    return {"day": _day.isoformat() if _day else None, "entries": len(_ranked), "names": len(_names)}
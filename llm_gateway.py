@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator
+import httpx
+from config import OPENROUTER_API_KEY
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Both providers speak the OpenAI chat-completions protocol; point OPENROUTER_URL
+# at llm_stub_server.py to test without a real provider.
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1")
+OPENROUTER_KEY = OPENROUTER_API_KEY or ""
+OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct")
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "")
+
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "30"))            # default seconds per call, retries included
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))          # per provider
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))   # consecutive failures to open
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # seconds before a trial call
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """Every provider failed, was skipped by its breaker, or the deadline ran out."""
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; lets one trial call through after `cooldown`."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            # A failed trial re-opens for another full cooldown
+            self.opened_at = time.monotonic()
+
+
+@dataclass
+class Provider:
+    name: str
+    base_url: str
+    api_key: str
+    model: str | None  # None = use the caller's model
+    breaker: CircuitBreaker
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key) if self.name == "openrouter" else bool(self.model)
+
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+
+# Failover order: OpenRouter first, local Ollama when it is down or unconfigured
+PROVIDERS = [
+    Provider("openrouter", OPENROUTER_URL, OPENROUTER_KEY, None,
+             CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)),
+    Provider("ollama", f"{OLLAMA_URL}/v1", "", OLLAMA_MODEL or None,
+             CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)),
+]
+
+_client: httpx.AsyncClient | None = None
+# call site -> counters
+_sites: dict[str, dict] = {}
+
+# =========================================
+# Public API
+# =========================================
+async def complete(messages: list[dict], site: str, model: str | None = None,
+                   max_tokens: int | None = None, deadline: float | None = None) -> str:
+    """
+    One chat completion. Retries with jittered backoff, skips providers whose
+    breaker is open and fails over in PROVIDERS order, all within `deadline` seconds.
+    """
+    stats = _site(site)
+    stats["calls"] += 1
+    started = time.monotonic()
+    ends_at = started + (deadline or LLM_DEADLINE)
+    payload = {"messages": messages}
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
+    last_error = None
+    for provider in _candidates(stats):
+        with _trial_guard(provider):
+            body = {**payload, "model": provider.model or model or OPENROUTER_MODEL}
+            attempted = False
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                remaining = ends_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                attempted = True
+                try:
+                    resp = await asyncio.wait_for(
+                        _get_client().post(f"{provider.base_url}/chat/completions",
+                                           headers=provider.headers(), json=body),
+                        timeout=remaining,
+                    )
+                    resp.raise_for_status()
+                    data = resp.json()
+                    content = data["choices"][0]["message"]["content"].strip()
+                except Exception as e:
+                    last_error = e
+                    if not await _backoff(stats, provider, e, attempt, ends_at):
+                        break
+                    continue
+                provider.breaker.record_success()
+                _record_success(stats, provider, started, data.get("usage"))
+                return content
+            if attempted:
+                provider.breaker.record_failure()
+            else:
+                # Out of time before trying it; release a half-open trial slot untouched
+                provider.breaker.trial_in_flight = False
+    stats["errors"] += 1
+    raise LLMUnavailable(f"No LLM provider answered for {site}: {last_error!r}")
+
+async def stream(messages: list[dict], site: str, model: str | None = None,
+                 deadline: float | None = None) -> AsyncIterator[str]:
+    """
+    Yield content deltas of a streamed completion. Retries and failover apply
+    until the first piece arrives; after that an error ends the stream.
+    """
+    stats = _site(site)
+    stats["calls"] += 1
+    started = time.monotonic()
+    ends_at = started + (deadline or LLM_DEADLINE)
+    last_error = None
+    for provider in _candidates(stats):
+        with _trial_guard(provider):
+            body = {"messages": messages, "model": provider.model or model or OPENROUTER_MODEL, "stream": True}
+            attempted = False
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                remaining = ends_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                attempted = True
+                yielded = False
+                usage = None
+                try:
+                    request = _get_client().build_request(
+                        "POST", f"{provider.base_url}/chat/completions", headers=provider.headers(), json=body
+                    )
+                    resp = await asyncio.wait_for(_get_client().send(request, stream=True), timeout=remaining)
+                    try:
+                        if resp.is_error:
+                            await resp.aread()
+                        resp.raise_for_status()
+                        lines = resp.aiter_lines()
+                        while True:
+                            # Each read waits at most until the deadline; the caller's work between pieces isn't interrupted
+                            try:
+                                line = await asyncio.wait_for(anext(lines), timeout=max(0.0, ends_at - time.monotonic()))
+                            except StopAsyncIteration:
+                                break
+                            # Blank lines separate events; ':' lines are keep-alive comments
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            chunk = json.loads(data)
+                            if "error" in chunk:
+                                raise ValueError(f"stream error: {chunk['error']}")
+                            usage = chunk.get("usage") or usage
+                            choices = chunk.get("choices") or [{}]
+                            content = choices[0].get("delta", {}).get("content")
+                            if content:
+                                if not yielded:
+                                    stats["first_token_ms_total"] += (time.monotonic() - started) * 1000
+                                yielded = True
+                                yield content
+                    finally:
+                        await resp.aclose()
+                except Exception as e:
+                    last_error = e
+                    if yielded:
+                        provider.breaker.record_failure()
+                        stats["errors"] += 1
+                        raise LLMUnavailable(f"{provider.name} stream broke for {site}: {e!r}") from e
+                    if not await _backoff(stats, provider, e, attempt, ends_at):
+                        break
+                    continue
+                stats["streams"] += 1
+                provider.breaker.record_success()
+                _record_success(stats, provider, started, usage)
+                return
+            if attempted:
+                provider.breaker.record_failure()
+            else:
+                # Out of time before trying it; release a half-open trial slot untouched
+                provider.breaker.trial_in_flight = False
+    stats["errors"] += 1
+    raise LLMUnavailable(f"No LLM provider answered for {site}: {last_error!r}")
+
+async def aclose():
+    """Close the shared client (call on shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def get_stats() -> dict:
+    """Per-call-site latency/token/error counters and each provider's breaker state."""
+    sites = {}
+    for site, s in _sites.items():
+        ok = s["calls"] - s["errors"]
+        sites[site] = {
+            **{k: v for k, v in s.items() if not k.endswith("_total")},
+            "latency_avg_ms": round(s["latency_ms_total"] / ok, 1) if ok else 0.0,
+            "first_token_avg_ms": round(s["first_token_ms_total"] / s["streams"], 1) if s["streams"] else 0.0,
+        }
+    return {
+        "sites": sites,
+        "providers": {
+            p.name: {"configured": p.configured, "breaker": p.breaker.state, "failures": p.breaker.failures}
+            for p in PROVIDERS
+        },
+    }
+
+# =========================================
+# Internals
+# =========================================
+def _get_client() -> httpx.AsyncClient:
+    """Shared keep-alive client; per-call deadlines are enforced around each request."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_DEADLINE, connect=5.0),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        )
+    return _client
+
+def _site(site: str) -> dict:
+    return _sites.setdefault(site, {
+        "calls": 0, "errors": 0, "retries": 0, "failovers": 0,
+        "prompt_tokens": 0, "completion_tokens": 0,
+        "latency_ms_total": 0.0, "latency_max_ms": 0.0, "streams": 0, "first_token_ms_total": 0.0,
+        "by_provider": {},
+    })
+
+@contextmanager
+def _trial_guard(provider: Provider):
+    """
+    Release a half-open trial slot the call took but never settled: a cancelled
+    task or an abandoned stream would otherwise keep the provider disabled forever.
+    """
+    took_trial = provider.breaker.trial_in_flight
+    try:
+        yield
+    finally:
+        if took_trial and provider.breaker.trial_in_flight:
+            provider.breaker.trial_in_flight = False
+
+def _candidates(stats: dict):
+    """Configured providers whose breaker admits a call, counting failovers past the first."""
+    first = True
+    for provider in PROVIDERS:
+        if not provider.configured or not provider.breaker.allow():
+            continue
+        if not first:
+            stats["failovers"] += 1
+        first = False
+        yield provider
+
+async def _backoff(stats: dict, provider: Provider, error: Exception, attempt: int, ends_at: float) -> bool:
+    """Sleep before the next attempt; False when the error isn't retryable or time is up."""
+    retryable = (
+        isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+        or (isinstance(error, httpx.HTTPStatusError) and error.response.status_code in RETRYABLE_STATUS)
+    )
+    logger.warning(f"LLM {provider.name} attempt {attempt + 1} failed: {error!r}")
+    if not retryable or attempt >= LLM_MAX_RETRIES:
+        return False
+    delay = LLM_RETRY_BASE_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
+    if time.monotonic() + delay >= ends_at:
+        return False
+    stats["retries"] += 1
+    await asyncio.sleep(delay)
+    return True
+
+def _record_success(stats: dict, provider: Provider, started: float, usage: dict | None):
+    latency_ms = (time.monotonic() - started) * 1000
+    stats["latency_ms_total"] += latency_ms
+    stats["latency_max_ms"] = max(stats["latency_max_ms"], round(latency_ms, 1))
+    stats["by_provider"][provider.name] = stats["by_provider"].get(provider.name, 0) + 1
+    if usage:
+        stats["prompt_tokens"] += usage.get("prompt_tokens", 0) or 0
+        stats["completion_tokens"] += usage.get("completion_tokens", 0) or 0
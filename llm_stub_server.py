@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+llm_stub_server.py
+
+A local OpenAI-compatible chat-completions server for exercising
+llm_gateway without a real provider. Supports plain and streamed
+(server-sent events) responses, with configurable latency and failures.
+
+    python llm_stub_server.py --port 8089 --fail-rate 0.2 --delay 0.05
+    OPENROUTER_URL=http://localhost:8089/v1 OPENROUTER_API_KEY=stub python main.py
+
+Set --fail-rate 1 to force failover to Ollama and trip the circuit breaker.
+"""
+import json
+import time
+import random
+import argparse
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+settings = {"delay": 0.05, "fail_rate": 0.0, "status": 503}
+
+STUB_ANSWER = (
+    "Listen up, recruit. Tailor the first three lines of your resume to the job post, "
+    "send five applications before noon, and follow up in 48 hours. One percent better tomorrow."
+)
+
+def _usage(messages: list[dict]) -> dict:
+    prompt_tokens = sum(len(m.get("content", "").split()) for m in messages)
+    completion_tokens = len(STUB_ANSWER.split())
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    body = request.get_json(force=True)
+    if random.random() < settings["fail_rate"]:
+        return jsonify({"error": {"message": "stub failure"}}), settings["status"]
+    model = body.get("model", "stub")
+    messages = body.get("messages", [])
+
+    if not body.get("stream"):
+        time.sleep(settings["delay"] * len(STUB_ANSWER.split()))
+        return jsonify({
+            "id": "stub-completion",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": STUB_ANSWER}, "finish_reason": "stop"}],
+            "usage": _usage(messages),
+        })
+
+    def events():
+        yield ": stub processing\n\n"
+        for word in STUB_ANSWER.split(" "):
+            time.sleep(settings["delay"])
+            chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        final = {"model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": _usage(messages)}
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(events(), mimetype="text/event-stream")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds per streamed word")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--status", type=int, default=503, help="HTTP status for failed requests")
+    args = parser.parse_args()
+    settings.update(delay=args.delay, fail_rate=args.fail_rate, status=args.status)
+    app.run(host="127.0.0.1", port=args.port, threaded=True)
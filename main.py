@@ -1,8 +1,9 @@
 import logging
 import os
 import asyncio
-from datetime import date
-from keep_alive import keep_alive
+from datetime import time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from keep_alive import keep_alive, register_metrics
 keep_alive()
 from dotenv import load_dotenv
 load_dotenv()
@@ -20,15 +21,31 @@ from telegram.ext import (
 from goal_command import (
     get_setgoal_handler,
     get_logjobs_handler,
-    progress
+    progress,
+    LOG_GIF_TAG
 )
 from username_command import get_setname_handler
-from leaderboard_command import leaderboard as leaderboard_actual
+from badge_command import get_badge_handler
+from ask_command import get_ask_handler
+import coach_command
+from leaderboard_command import (
+    leaderboard as leaderboard_actual,
+    get_leaderboard_page_handler,
+    schedule_board_refresh
+)
 from config import TELEGRAM_BOT_TOKEN
-from reminders import register_reminders
-from db import get_pg_conn, init_db_pg
+from reminders import register_reminders, REMINDER_GIF_TAGS, is_subscribed, set_subscription
+from db import acquire, init_db_pg, close_pool, get_pool_stats, get_user_profiles
 from seed_daily_funny_data import seed_funny_data
-from wrapup import send_wrapup
+from wrapup import send_wrapup, WRAPUP_GIF_TAG, WRAPUP_GIF_RATING
+import gif_service
+import scheduler
+import today_cache
+import leaderboard_index
+import badge_utils
+import answer_cache
+import llm_gateway
+from broadcast import broadcast, Outgoing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -42,32 +59,34 @@ async def wrapup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     display_name = update.effective_user.first_name or str(chat_id)
     chat_names = {chat_id: display_name}
-    await send_wrapup(context.application, [chat_id], chat_names)
+    # Preview the wrap-up this user's timezone bucket gets tonight
+    tz_name = scheduler.get_user_timezone(chat_id)
+    day = scheduler.local_date(tz_name)
+    await today_cache.flush()
+    user_profiles = await get_user_profiles(timezone=tz_name, day=day)
+    await send_wrapup(context.application, [chat_id], chat_names, user_profiles, day)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
 
-    conn = await get_pg_conn()
-    await conn.execute(
-        "INSERT INTO users(user_id, username, first_name) VALUES($1, $2, $3) "
-        "ON CONFLICT (user_id) DO UPDATE SET first_name = EXCLUDED.first_name",
-        user_id, '', user.first_name or ''
-    )
-    row = await conn.fetchrow(
-        "SELECT COALESCE(NULLIF(username, ''), first_name) AS display_name "
-        "FROM users WHERE user_id = $1",
-        user_id
-    )
-    display_name = row['display_name'] if row and row['display_name'] else 'there'
+    async with acquire() as conn:
+        await conn.execute(
+            "INSERT INTO users(user_id, username, first_name) VALUES($1, $2, $3) "
+            "ON CONFLICT (user_id) DO UPDATE SET first_name = EXCLUDED.first_name",
+            user_id, '', user.first_name or ''
+        )
+        row = await conn.fetchrow(
+            "SELECT COALESCE(NULLIF(username, ''), first_name) AS display_name "
+            "FROM users WHERE user_id = $1",
+            user_id
+        )
+        display_name = row['display_name'] if row and row['display_name'] else 'there'
 
-    today = date.today().isoformat()
-    row2 = await conn.fetchrow(
-        "SELECT goal FROM daily_track WHERE user_id = $1 AND date = $2",
-        user_id, today
-    )
-    has_goal = bool(row2 and row2['goal'] > 0)
-    await conn.close()
+    scheduler.track_user(user_id)
+    leaderboard_index.set_name(user_id, row['display_name'] if row else None)
+    goal, _ = await today_cache.get(user_id, create=False)
+    has_goal = goal > 0
 
     tip = ""
     if not has_goal:
@@ -76,6 +95,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     main_kb = ReplyKeyboardMarkup([
         ['/logjobs', '/setgoal'],
         ['/leaderboard', '/progress'],
+        ['/badges', '/ask'],
         ['/settings']
     ], resize_keyboard=True)
 
@@ -83,8 +103,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"\ud83d\udc4b Welcome back, {display_name}!\n\nHere\u2019s what you can do:\n"
         "\u2022 `/logjobs` — Log your applications\n"
         "\u2022 `/setgoal` — Set or change your daily goal\n"
-        "\u2022 `/leaderboard` — See today’s top applicants\n"
+        "\u2022 `/leaderboard` — See your rank and today’s, weekly or all-time boards\n"
         "\u2022 `/progress` — See your weekly progress\n"
+        "\u2022 `/badges` — See your badges and progress towards the next ones\n"
+        "\u2022 `/ask` — Ask the coach a career question\n"
+        "\u2022 `/weeklyreview` — Your weekly summary or a tough-love coach review\n"
         "\u2022 `/settings` — Configure name, reminders, and more" + tip,
         reply_markup=main_kb,
         parse_mode="Markdown"
@@ -112,13 +135,15 @@ async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     settings_kb = ReplyKeyboardMarkup([
         ['/setname', '/reminders'],
-        ['/about', '/help'],
+        ['/timezone', '/about'],
+        ['/help'],
         ['\ud83c\udfe0 Home']
     ], resize_keyboard=True)
     await update.message.reply_text(
         "\u2699\ufe0f *Settings*\n\n"
         "\u2022 `/setname` — Change your display name\n"
         "\u2022 `/reminders` — Toggle reminders on or off\n"
+        "\u2022 `/timezone` — Set your timezone for reminders and wrap-ups\n"
         "\u2022 `/about` — About this bot\n"
         "\u2022 `/help` — Show help info\n",
         reply_markup=settings_kb,
@@ -145,22 +170,20 @@ async def toggle_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query:
         await update.callback_query.answer()
 
-    conn = await get_pg_conn()
-    row = await conn.fetchrow(
-        "SELECT reminders_enabled FROM user_preferences WHERE user_id = $1",
-        user_id
-    )
-    new_state = not bool(row and row['reminders_enabled'])
-    await conn.execute(
-        "INSERT INTO user_preferences(user_id, reminders_enabled) VALUES($1,$2) "
-        "ON CONFLICT (user_id) DO UPDATE SET reminders_enabled = EXCLUDED.reminders_enabled",
-        user_id, new_state
-    )
-    await conn.close()
+    new_state = not is_subscribed(user_id)
+    async with acquire() as conn:
+        await conn.execute(
+            "INSERT INTO user_preferences(user_id, reminders_enabled) VALUES($1,$2) "
+            "ON CONFLICT (user_id) DO UPDATE SET reminders_enabled = EXCLUDED.reminders_enabled",
+            user_id, new_state
+        )
+    # Takes effect from the next reminder slot, no restart needed
+    set_subscription(user_id, new_state)
+    scheduler.track_user(user_id)
 
     status = "ON" if new_state else "OFF"
     text = (
-        f"\ud83d\udd14 Reminders are now *{status}*. I will send you reminders at 09:00, 15:00, and 21:00 daily."
+        f"\ud83d\udd14 Reminders are now *{status}*. I will send you reminders at 09:00, 15:00, and 21:00 daily (your local time)."
     )
     btn_label = "Turn OFF" if new_state else "Turn ON"
     keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(btn_label, callback_data="toggle_reminders")]])
@@ -170,16 +193,53 @@ async def toggle_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(text, parse_mode="Markdown", reply_markup=keyboard)
 
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not context.args:
+        await update.message.reply_text(
+            f"\ud83c\udf0d Your timezone is *{scheduler.get_user_timezone(user.id)}*.\n"
+            "Change it with `/timezone Area/City`, e.g. `/timezone Europe/Berlin`.",
+            parse_mode="Markdown"
+        )
+        return
+
+    tz_name = context.args[0].strip()
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        await update.message.reply_text(
+            f"\u274c I don't know the timezone `{tz_name}`. Try something like `America/Toronto`.",
+            parse_mode="Markdown"
+        )
+        return
+
+    async with acquire() as conn:
+        await conn.execute(
+            "INSERT INTO users(user_id, username, first_name, timezone) VALUES($1, $2, $3, $4) "
+            "ON CONFLICT (user_id) DO UPDATE SET timezone = EXCLUDED.timezone",
+            user.id, '', user.first_name or '', tz_name
+        )
+    scheduler.set_user_timezone(user.id, tz_name)
+    logger.info(f"/timezone set to {tz_name} by user {user.id}")
+    await update.message.reply_text(
+        f"\u2705 Timezone set to *{tz_name}*. Reminders and wrap-ups will follow your local time.",
+        parse_mode="Markdown"
+    )
+
 async def testdb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"/testdb triggered by user {update.effective_user.id}")
     try:
-        conn = await get_pg_conn()
-        rows = await conn.fetch(
-            "SELECT table_name FROM information_schema.tables WHERE table_schema='public';"
-        )
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT table_name FROM information_schema.tables WHERE table_schema='public';"
+            )
         names = ", ".join(r['table_name'] for r in rows)
-        await update.message.reply_text(f"\u2705 Connected! Tables: {names}")
-        await conn.close()
+        stats = get_pool_stats()
+        await update.message.reply_text(
+            f"\u2705 Connected! Tables: {names}\n"
+            f"Pool: {stats['in_use']} in use / {stats['idle']} idle "
+            f"(max {stats['max_size']}), avg wait {stats['wait_avg_ms']} ms"
+        )
     except Exception as e:
         logger.error(f"/testdb error: {e}")
         await update.message.reply_text(f"\u274c Connection failed: {e}")
@@ -189,50 +249,94 @@ if __name__ == "__main__":
     logger.info("\ud83d\udd25 Running JobPal…")
     asyncio.get_event_loop().run_until_complete(init_db_pg())
 
-    app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    register_metrics("db_pool", get_pool_stats)
+    register_metrics("gifs", gif_service.get_stats)
+    register_metrics("today_cache", today_cache.get_stats)
+    register_metrics("leaderboard", leaderboard_index.get_stats)
+    register_metrics("badges", badge_utils.get_event_stats)
+    register_metrics("answer_cache", answer_cache.get_stats)
+    register_metrics("llm", llm_gateway.get_stats)
+    register_metrics("coach_reviews", coach_command.get_stats)
+
+    async def on_startup(application):
+        await leaderboard_index.rebuild()
+        answer_cache.load()
+        # Warm the GIF pools so handlers never wait on Giphy
+        for tag in (LOG_GIF_TAG, *REMINDER_GIF_TAGS):
+            gif_service.prefetch(tag)
+        gif_service.prefetch(WRAPUP_GIF_TAG, rating=WRAPUP_GIF_RATING)
+
+    async def on_shutdown(application):
+        await today_cache.flush()
+        await answer_cache.save()
+        await gif_service.aclose()
+        await llm_gateway.aclose()
+        await close_pool()
+
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Register handlers
     app.add_handler(MessageHandler(filters.Regex(r"^\ud83c\udfe0 Home$"), start))
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("settings", settings_command))
     app.add_handler(CommandHandler("reminders", toggle_reminders))
+    app.add_handler(CommandHandler("timezone", timezone_command))
     app.add_handler(CallbackQueryHandler(toggle_reminders, pattern="^toggle_reminders$"))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("about", about))
     app.add_handler(CommandHandler("leaderboard", leaderboard))
+    app.add_handler(get_leaderboard_page_handler())
     app.add_handler(CommandHandler("progress", progress_handler))
     app.add_handler(CommandHandler("wrapup", wrapup_command))
     app.add_handler(CommandHandler("testdb", testdb))
     app.add_handler(get_setgoal_handler())
     app.add_handler(get_logjobs_handler())
     app.add_handler(get_setname_handler())
+    app.add_handler(get_badge_handler())
+    app.add_handler(get_ask_handler())
+    for handler in coach_command.get_coachsummary_handler():
+        app.add_handler(handler)
     app.add_handler(CallbackQueryHandler(start, pattern="^cancel$"))
 
     # Configure JobQueue timezone and schedule reminders
-    from zoneinfo import ZoneInfo
     app.job_queue.scheduler.configure(timezone=ZoneInfo("America/Toronto"))
+    asyncio.get_event_loop().run_until_complete(scheduler.load_timezones())
     asyncio.get_event_loop().run_until_complete(register_reminders(app.job_queue))
 
-    # === Schedule Daily Wrap-up ===
-    from db import get_user_profiles
-    from wrapup import send_wrapup
-    from apscheduler.schedulers.asyncio import AsyncIOScheduler
-
-    async def run_daily_wrapup():
-        user_profiles = await get_user_profiles()
+    # === Schedule Daily Wrap-up (22:00 local, per timezone) ===
+    async def run_daily_wrapup(context, slot, tz_name, user_ids, day):
+        await today_cache.flush()
+        user_profiles = await get_user_profiles(timezone=tz_name, day=day)
+        if not user_profiles:
+            return
         chat_ids = list(user_profiles.keys())
-        conn = await get_pg_conn()
-        rows = await conn.fetch(
-            "SELECT user_id, COALESCE(NULLIF(username, ''), first_name) AS name FROM users WHERE user_id = ANY($1::BIGINT[])",
-            chat_ids
-        )
-        await conn.close()
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT user_id, COALESCE(NULLIF(username, ''), first_name) AS name FROM users WHERE user_id = ANY($1::BIGINT[])",
+                chat_ids
+            )
         chat_names = {r["user_id"]: r["name"] for r in rows}
-        await send_wrapup(app, chat_ids, chat_names, user_profiles)
+        await send_wrapup(app, chat_ids, chat_names, user_profiles, day)
+
+        # day_closed: resync badge counters for this timezone and award what the day earned
+        awarded = await badge_utils.check_badges_for_all(chat_ids)
+        if awarded:
+            await broadcast(app.bot, [
+                Outgoing(uid, badge_utils.format_new_badges(names)) for uid, names in awarded.items()
+            ], "badges")
 
-    scheduler = AsyncIOScheduler(timezone=ZoneInfo("America/Toronto"))
-    scheduler.add_job(lambda: asyncio.create_task(run_daily_wrapup()), trigger="cron", hour=22, minute=0)
-    scheduler.start()
+    scheduler.add_slot("wrapup", time(hour=22, minute=0), run_daily_wrapup)
+    scheduler.start(app.job_queue)
+    today_cache.start(app.job_queue)
+    answer_cache.start(app.job_queue)
+    coach_command.schedule_review_batch(app.job_queue)
+    schedule_board_refresh(app.job_queue)
 
     logger.info("\ud83e\udd16 JobPal is live! Press Ctrl+C to stop.")
     app.run_polling(drop_pending_updates=True)
@@ -1,131 +1,115 @@
 import logging
 from datetime import time, date
-from telegram import Update
 from telegram.ext import ContextTypes
-from db import get_db_connection
-from config import GIPHY_API_KEY
-import requests
+from db import acquire
+from broadcast import broadcast, Outgoing
+import gif_service
+import scheduler
+import today_cache
 
 logger = logging.getLogger(__name__)
 
+MORNING_GIF_TAG = "come catch me cat"
+AFTERNOON_GIF_TAG = "typing cat"
+EVENING_GIF_TAG = "Sleepy Cat Dont Bug Me"
+REMINDER_GIF_TAGS = (MORNING_GIF_TAG, AFTERNOON_GIF_TAG, EVENING_GIF_TAG)
+
 # =========================================
-# Helper to fetch display name and stats via Postgres
+# Reminder messages
 # =========================================
-async def _get_user_info(user_id: int):
-    conn = await get_db_connection()
-    # Fetch display name
-    row = await conn.fetchrow(
-        "SELECT COALESCE(NULLIF(username, ''), first_name) AS display_name "
-        "FROM users WHERE user_id = $1",
-        user_id
-    )
-    display_name = row['display_name'] if row else 'there'
+def morning_text(display_name: str, goal: int, done: int) -> str:
+    return f"😺 Good morning, {display_name}! You have a goal of {goal} applications today."
 
-    # Fetch today's goal and done
-    today_iso = date.today().isoformat()
-    row2 = await conn.fetchrow(
-        "SELECT goal, done FROM daily_track WHERE user_id = $1 AND date = $2",
-        user_id, today_iso
-    )
-    if row2:
-        goal, done = row2['goal'], row2['done']
-    else:
-        goal, done = 0, 0
+def afternoon_text(display_name: str, goal: int, done: int) -> str:
+    return f"🐱 How’s the hunt, {display_name}? {done} logged out of {goal} so far—keep going!"
+
+def evening_text(display_name: str, goal: int, done: int) -> str:
+    return f"🌠 Final call, {display_name}! You've logged {done}/{goal}. Last chance before leaderboard!"
 
-    await conn.close()
-    return display_name, goal, done
+# slot name -> (local time, message builder, GIF tag)
+REMINDER_SLOTS = {
+    "morning": (time(hour=9, minute=0), morning_text, MORNING_GIF_TAG),
+    "afternoon": (time(hour=15, minute=0), afternoon_text, AFTERNOON_GIF_TAG),
+    "evening": (time(hour=21, minute=0), evening_text, EVENING_GIF_TAG),
+}
 
 # =========================================
-# Helper to fetch a random GIF from Giphy
+# Subscription index (backed by user_preferences)
 # =========================================
-async def _get_random_gif(tag: str):
-    try:
-        resp = requests.get(
-            "https://api.giphy.com/v1/gifs/random",
-            params={"api_key": GIPHY_API_KEY, "tag": tag, "rating": "pg"},
-            timeout=5
+# Users with reminders enabled. Loaded once at startup, then kept current by
+# set_subscription() so toggles apply without re-reading the table.
+_subscribers: set[int] = set()
+
+async def load_subscriptions():
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT user_id FROM user_preferences WHERE reminders_enabled = TRUE"
         )
-        data = resp.json().get("data", {})
-        return data.get("images", {}).get("original", {}).get("url")
-    except Exception as e:
-        logger.warning(f"Giphy API error for tag '{tag}': {e}")
-        return None
+    _subscribers.clear()
+    _subscribers.update(r['user_id'] for r in rows)
+    # Subscribers without a users row still need a timezone bucket
+    for user_id in _subscribers:
+        scheduler.track_user(user_id)
+    logger.info(f"Loaded {len(_subscribers)} reminder subscriptions")
+
+def is_subscribed(user_id: int) -> bool:
+    return user_id in _subscribers
+
+def set_subscription(user_id: int, enabled: bool):
+    """Apply a toggle to the live index (call after persisting it)."""
+    if enabled:
+        _subscribers.add(user_id)
+    else:
+        _subscribers.discard(user_id)
 
 # =========================================
-# Reminder Callbacks (async)  
+# Bulk recipient lookup via Postgres
 # =========================================
-async def morning_reminder(context: ContextTypes.DEFAULT_TYPE):
-    """Send morning reminder at 09:00."""
-    job = context.job
-    user_id = job.chat_id
-
-    display_name, goal, _ = await _get_user_info(user_id)
-    text = f"😺 Good morning, {display_name}! You have a goal of {goal} applications today."
-    await context.bot.send_message(chat_id=user_id, text=text)
-
-    gif_url = await _get_random_gif("come catch me cat")
-    if gif_url:
-        await context.bot.send_animation(chat_id=user_id, animation=gif_url)
-
-async def afternoon_reminder(context: ContextTypes.DEFAULT_TYPE):
-    """Send afternoon reminder at 15:00."""
-    job = context.job
-    user_id = job.chat_id
-
-    display_name, goal, done = await _get_user_info(user_id)
-    text = f"🐱 How’s the hunt, {display_name}? {done} logged out of {goal} so far—keep going!"
-    await context.bot.send_message(chat_id=user_id, text=text)
-
-    gif_url = await _get_random_gif("typing cat")
-    if gif_url:
-        await context.bot.send_animation(chat_id=user_id, animation=gif_url)
-
-async def evening_reminder(context: ContextTypes.DEFAULT_TYPE):
-    """Send evening reminder at 21:00."""
-    job = context.job
-    user_id = job.chat_id
+async def _load_recipients(user_ids: list[int], day: date) -> list[tuple[int, str, int, int]]:
+    """
+    Names and goal/done on `day` (the bucket's local date) for the given users, in a single query.
+    """
+    if not user_ids:
+        return []
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT s.user_id,
+                   COALESCE(NULLIF(u.username, ''), u.first_name) AS display_name,
+                   COALESCE(dt.goal, 0) AS goal,
+                   COALESCE(dt.done, 0) AS done
+            FROM unnest($2::BIGINT[]) AS s(user_id)
+            LEFT JOIN users u ON u.user_id = s.user_id
+            LEFT JOIN daily_track dt ON dt.user_id = s.user_id AND dt.date = $1
+            """,
+            day, user_ids
+        )
+    # Overlay counts that are still waiting in the write-behind cache
+    return [
+        (r['user_id'], r['display_name'] or 'there', *(today_cache.peek(r['user_id']) or (r['goal'], r['done'])))
+        for r in rows
+    ]
 
-    display_name, goal, done = await _get_user_info(user_id)
-    text = f"🌠 Final call, {display_name}! You've logged {done}/{goal}. Last chance before leaderboard!"
-    await context.bot.send_message(chat_id=user_id, text=text)
+# =========================================
+# Slot dispatcher (async)
+# =========================================
+async def dispatch_reminders(context: ContextTypes.DEFAULT_TYPE, slot: str, tz_name: str, user_ids: set[int], day: date):
+    """Send one reminder slot to the subscribed users of one timezone bucket."""
+    _, build_text, gif_tag = REMINDER_SLOTS[slot]
 
-    gif_url = await _get_random_gif("Sleepy Cat Dont Bug Me")
-    if gif_url:
-        await context.bot.send_animation(chat_id=user_id, animation=gif_url)
+    recipients = await _load_recipients([uid for uid in user_ids if uid in _subscribers], day)
+    outgoing = [
+        Outgoing(user_id, text=build_text(display_name, goal, done), animation=gif_service.get_gif(gif_tag))
+        for user_id, display_name, goal, done in recipients
+    ]
+    await broadcast(context.bot, outgoing, label=f"{slot} reminders ({tz_name})")
 
 # =========================================
-# Registration (per-user via Postgres preferences)
+# Registration (one slot per reminder, fired per timezone)
 # =========================================
 async def register_reminders(job_queue):
-    # Fetch users with reminders enabled
-    conn = await get_db_connection()
-    rows = await conn.fetch(
-        "SELECT user_id FROM user_preferences WHERE reminders_enabled = TRUE"
-    )
-    await conn.close()
+    await load_subscriptions()
 
-    # Configure scheduler to use Toronto timezone once
-    try:
-        from zoneinfo import ZoneInfo
-        job_queue.scheduler.configure(timezone=ZoneInfo("America/Toronto"))
-    except Exception as e:
-        logger.warning(f"Scheduler timezone config failed: {e}")
-
-    # Schedule daily reminders in local time
-    for r in rows:
-        uid = r['user_id']
-        job_queue.run_daily(
-            morning_reminder,
-            time=time(hour=9, minute=0),
-            chat_id=uid
-        )
-        job_queue.run_daily(
-            afternoon_reminder,
-            time=time(hour=15, minute=0),
-            chat_id=uid
-        )
-        job_queue.run_daily(
-            evening_reminder,
-            time=time(hour=21, minute=0),
-            chat_id=uid
-        )
+    # Each slot fires at its local time in every user timezone
+    for slot, (slot_time, _, _) in REMINDER_SLOTS.items():
+        scheduler.add_slot(slot, slot_time, dispatch_reminders)
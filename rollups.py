@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+rollups.py
+
+Weekly (ISO week) and monthly per-user rollups of daily_track:
+goal sum, done sum, days the goal was met, and the longest run of active
+days (done > 0) inside the period.
+
+Rollups are refreshed incrementally for just the periods a daily_track
+write touched (see today_cache.flush). Schema migration 8 fills them from
+existing history on upgrade. To rebuild them from scratch:
+
+    python rollups.py backfill
+"""
+import asyncio
+import logging
+from datetime import date, timedelta
+from db import acquire, init_db_pg
+
+logger = logging.getLogger(__name__)
+
+# table, key columns, and the SQL expressions that derive them from a date
+PERIODS = {
+    "week": ("weekly_rollup", ("iso_year", "iso_week"),
+             ("EXTRACT(ISOYEAR FROM date)::int", "EXTRACT(WEEK FROM date)::int")),
+    "month": ("monthly_rollup", ("year", "month"),
+              ("EXTRACT(YEAR FROM date)::int", "EXTRACT(MONTH FROM date)::int")),
+}
+
+# $1 = user ids (NULL for everyone), $2..$3 = date range covering whole periods
+_REFRESH_SQL = """
+WITH days AS (
+  SELECT user_id, date, goal, done, {e1} AS k1, {e2} AS k2
+  FROM daily_track
+  WHERE ($1::BIGINT[] IS NULL OR user_id = ANY($1::BIGINT[]))
+    AND date BETWEEN $2 AND $3
+),
+islands AS (
+  SELECT user_id, k1, k2,
+         date - (ROW_NUMBER() OVER (PARTITION BY user_id, k1, k2 ORDER BY date))::int AS island
+  FROM days
+  WHERE done > 0
+),
+streaks AS (
+  SELECT user_id, k1, k2, MAX(len) AS longest
+  FROM (SELECT user_id, k1, k2, COUNT(*) AS len FROM islands GROUP BY user_id, k1, k2, island) runs
+  GROUP BY user_id, k1, k2
+)
+INSERT INTO {table} (user_id, {c1}, {c2}, goal_sum, done_sum, days_met, longest_streak)
+SELECT d.user_id, d.k1, d.k2,
+       SUM(d.goal), SUM(d.done),
+       COUNT(*) FILTER (WHERE d.goal > 0 AND d.done >= d.goal),
+       COALESCE(s.longest, 0)
+FROM days d
+LEFT JOIN streaks s ON s.user_id = d.user_id AND s.k1 = d.k1 AND s.k2 = d.k2
+GROUP BY d.user_id, d.k1, d.k2, s.longest
+ON CONFLICT (user_id, {c1}, {c2}) DO UPDATE SET
+  goal_sum = EXCLUDED.goal_sum,
+  done_sum = EXCLUDED.done_sum,
+  days_met = EXCLUDED.days_met,
+  longest_streak = EXCLUDED.longest_streak
+"""
+
+def _refresh_sql(period: str) -> str:
+    table, (c1, c2), (e1, e2) = PERIODS[period]
+    return _REFRESH_SQL.format(table=table, c1=c1, c2=c2, e1=e1, e2=e2)
+
+def period_bounds(period: str, day: date) -> tuple[date, date]:
+    """First and last day of the ISO week / calendar month containing `day`."""
+    if period == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    start = day.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+# =========================================
+# Maintenance
+# =========================================
+async def refresh(conn, written: list[tuple[int, date]]):
+    """
+    Recompute the week and month rollups touched by daily_track writes.
+    `written` is [(user_id, day)]; each distinct period costs one statement.
+    """
+    touched: dict[tuple[str, date, date], set[int]] = {}
+    for user_id, day in written:
+        for period in PERIODS:
+            start, end = period_bounds(period, day)
+            touched.setdefault((period, start, end), set()).add(user_id)
+    for (period, start, end), user_ids in touched.items():
+        await conn.execute(_refresh_sql(period), list(user_ids), start, end)
+
+async def backfill():
+    """Rebuild every rollup row from the full daily_track history."""
+    async with acquire() as conn:
+        bounds = await conn.fetchrow("SELECT MIN(date) AS first, MAX(date) AS last FROM daily_track")
+        if not bounds or bounds["first"] is None:
+            logger.info("daily_track is empty, nothing to backfill")
+            return
+        for period in PERIODS:
+            start, _ = period_bounds(period, bounds["first"])
+            _, end = period_bounds(period, bounds["last"])
+            async with conn.transaction():
+                await conn.execute(_refresh_sql(period), None, start, end)
+            logger.info(f"Backfilled {PERIODS[period][0]} for {start}..{end}")
+
+# =========================================
+# Reads
+# =========================================
+async def get_rollups(user_id: int, period: str, count: int) -> list[dict]:
+    """The user's last `count` week/month rollups, oldest first."""
+    table, (c1, c2), _ = PERIODS[period]
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            SELECT {c1} AS k1, {c2} AS k2, goal_sum, done_sum, days_met, longest_streak
+            FROM {table}
+            WHERE user_id = $1
+            ORDER BY {c1} DESC, {c2} DESC
+            LIMIT $2
+            """,
+            user_id, count
+        )
+    return [dict(r) for r in reversed(rows)]
+
+async def get_totals(user_id: int) -> dict:
+    """
+    Lifetime totals from the monthly rollups (a few rows, not months of daily rows).
+    The longest streak can't come from them: a run crossing a month boundary is
+    split there, so it is found across the user's active days instead (one
+    index range on daily_track's primary key).
+    """
+    async with acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            WITH islands AS (
+              SELECT date - (ROW_NUMBER() OVER (ORDER BY date))::int AS island
+              FROM daily_track
+              WHERE user_id = $1 AND done > 0
+            )
+            SELECT COALESCE(SUM(goal_sum), 0) AS goal_sum,
+                   COALESCE(SUM(done_sum), 0) AS done_sum,
+                   COALESCE(SUM(days_met), 0) AS days_met,
+                   (SELECT COALESCE(MAX(len), 0)
+                    FROM (SELECT COUNT(*) AS len FROM islands GROUP BY island) runs) AS longest_streak
+            FROM monthly_rollup
+            WHERE user_id = $1
+            """,
+            user_id
+        )
+    return dict(row)
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain weekly/monthly rollup tables.")
+    parser.add_argument("command", choices=["backfill"])
+    args = parser.parse_args()
+
+    async def run():
+        await init_db_pg()
+        await backfill()
+
+    asyncio.run(run())
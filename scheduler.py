@@ -0,0 +1,99 @@
+import os
+import logging
+from datetime import date, datetime, timedelta, time
+from zoneinfo import ZoneInfo
+from telegram.ext import ContextTypes
+from db import acquire, DEFAULT_TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SCHEDULER_TICK_SECONDS = int(os.getenv("SCHEDULER_TICK_SECONDS", "60"))
+# A slot still fires if the bot was down or busy for up to this long past it
+SCHEDULER_GRACE_MINUTES = int(os.getenv("SCHEDULER_GRACE_MINUTES", "10"))
+
+# user_id -> IANA timezone name, and the reverse buckets
+_user_timezones: dict[int, str] = {}
+_buckets: dict[str, set[int]] = {DEFAULT_TIMEZONE: set()}
+# slot name -> (local time, async callback(context, slot, tz_name, user_ids, day))
+_slots: dict[str, tuple[time, object]] = {}
+# (slot, tz_name, local date) already dispatched
+_fired: set[tuple[str, str, object]] = set()
+
+# =========================================
+# Timezone index
+# =========================================
+async def load_timezones():
+    async with acquire() as conn:
+        rows = await conn.fetch("SELECT user_id, timezone FROM users")
+    _user_timezones.clear()
+    _buckets.clear()
+    _buckets[DEFAULT_TIMEZONE] = set()
+    for r in rows:
+        _assign(r['user_id'], r['timezone'] or DEFAULT_TIMEZONE)
+    logger.info(f"Loaded timezones for {len(_user_timezones)} users across {len(_buckets)} zones")
+
+def get_user_timezone(user_id: int) -> str:
+    return _user_timezones.get(user_id, DEFAULT_TIMEZONE)
+
+def set_user_timezone(user_id: int, tz_name: str):
+    """Move a user to another bucket (call after persisting users.timezone)."""
+    old = _user_timezones.get(user_id)
+    if old is not None:
+        _buckets.get(old, set()).discard(user_id)
+    _assign(user_id, tz_name)
+
+def local_date(tz_name: str) -> date:
+    """Today's date in the given zone."""
+    return datetime.now(ZoneInfo(tz_name)).date()
+
+def user_date(user_id: int) -> date:
+    """Today's date where the user lives."""
+    return local_date(get_user_timezone(user_id))
+
+def track_user(user_id: int):
+    """Make sure a (possibly new) user is in a bucket."""
+    if user_id not in _user_timezones:
+        _assign(user_id, DEFAULT_TIMEZONE)
+
+def _assign(user_id: int, tz_name: str):
+    _user_timezones[user_id] = tz_name
+    _buckets.setdefault(tz_name, set()).add(user_id)
+
+# =========================================
+# Local-time slots
+# =========================================
+def add_slot(name: str, at: time, callback):
+    """
+    Run `callback(context, name, tz_name, user_ids, day)` once per day for each
+    timezone bucket, when the local time in that zone reaches `at`; `day` is
+    that zone's local date, which the server's date.today() may not match.
+    """
+    _slots[name] = (at, callback)
+
+def start(job_queue):
+    job_queue.run_repeating(_tick, interval=SCHEDULER_TICK_SECONDS, first=1, name="local-time-scheduler")
+
+async def _run_slot(callback, context, slot: str, tz_name: str, user_ids: set[int], day: date):
+    try:
+        await callback(context, slot, tz_name, user_ids, day)
+    except Exception as e:
+        logger.error(f"Slot {slot} failed for {tz_name}: {e}", exc_info=True)
+
+async def _tick(context: ContextTypes.DEFAULT_TYPE):
+    now_utc = datetime.now(ZoneInfo("UTC"))
+    grace = timedelta(minutes=SCHEDULER_GRACE_MINUTES)
+    for tz_name, user_ids in list(_buckets.items()):
+        local_now = now_utc.astimezone(ZoneInfo(tz_name))
+        for slot, (at, callback) in _slots.items():
+            due = datetime.combine(local_now.date(), at, tzinfo=local_now.tzinfo)
+            key = (slot, tz_name, local_now.date())
+            if key in _fired or not (due <= local_now < due + grace):
+                continue
+            _fired.add(key)
+            logger.info(f"⏰ {slot} due in {tz_name} for {len(user_ids)} users")
+            # Run in the background so a long wrap-up never delays the next tick
+            context.application.create_task(_run_slot(callback, context, slot, tz_name, set(user_ids), local_now.date()))
+    # Forget dispatches from more than two days ago so the set stays small
+    cutoff = now_utc.date() - timedelta(days=2)
+    _fired.difference_update({key for key in _fired if key[2] < cutoff})
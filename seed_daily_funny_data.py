@@ -50,7 +50,7 @@ print(f"→ Seeding into: {DATABASE_URL}")
 import asyncio
 import random
 from datetime import date
-from db import get_pg_conn, init_db_pg
+from db import acquire, init_db_pg
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from zoneinfo import ZoneInfo
 
@@ -69,41 +69,39 @@ USER_PROFILES = [
 async def seed_funny_data():
     # Ensure tables exist
     await init_db_pg()
-    conn = await get_pg_conn()
+    async with acquire() as conn:
+        # Upsert fake users
+        await conn.executemany(
+            """
+            INSERT INTO users(user_id, username, first_name)
+            VALUES ($1,$2,$3)
+            ON CONFLICT (user_id) DO NOTHING;
+            """,
+            USER_PROFILES
+        )
 
-    # Upsert fake users
-    await conn.executemany(
-        """
-        INSERT INTO users(user_id, username, first_name)
-        VALUES ($1,$2,$3)
-        ON CONFLICT (user_id) DO NOTHING;
-        """,
-        USER_PROFILES
-    )
-
-    # Seed today's daily_track
-    today_iso = date.today().isoformat()
-    records = []
-    for uid, _, _ in USER_PROFILES:
-        goal = random.randint(GOAL_MIN, GOAL_MAX)
-        done = max(0, min(15, int(random.gauss(4, 3))))
-        records.append((uid, today_iso, goal, done))
+        # Seed today's daily_track
+        today = date.today()
+        records = []
+        for uid, _, _ in USER_PROFILES:
+            goal = random.randint(GOAL_MIN, GOAL_MAX)
+            done = max(0, min(15, int(random.gauss(4, 3))))
+            records.append((uid, today, goal, done))
 
-    await conn.executemany(
-        """
-        INSERT INTO daily_track(user_id, date, goal, done)
-        VALUES ($1,$2,$3,$4)
-        ON CONFLICT (user_id, date)
-        DO UPDATE SET goal = EXCLUDED.goal, done = EXCLUDED.done;
-        """,
-        records
-    )
+        await conn.executemany(
+            """
+            INSERT INTO daily_track(user_id, date, goal, done)
+            VALUES ($1,$2,$3,$4)
+            ON CONFLICT (user_id, date)
+            DO UPDATE SET goal = EXCLUDED.goal, done = EXCLUDED.done;
+            """,
+            records
+        )
 
-    # Sanity check
-    rows = await conn.fetch("SELECT * FROM daily_track WHERE date = $1", today_iso)
-    print(f"👉 Found {len(rows)} rows for {today_iso}")
+        # Sanity check
+        rows = await conn.fetch("SELECT * FROM daily_track WHERE date = $1", today)
+        print(f"👉 Found {len(rows)} rows for {today.isoformat()}")
 
-    await conn.close()
     print(f"✅ Seeded {len(USER_PROFILES)} users. Goals ranged {GOAL_MIN}–{GOAL_MAX}.")
 
 if __name__ == "__main__":
@@ -48,7 +48,7 @@ async def seed_data():
     today = date.today()
     records = []
     for offset in range(DAYS_BACK + 1):
-        d = (today - timedelta(days=offset)).isoformat()
+        d = today - timedelta(days=offset)
         for i in range(USER_COUNT):
             uid = USER_START_ID + i
             done = random.randint(0, GOAL_PER_DAY)
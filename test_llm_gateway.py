@@ -0,0 +1,69 @@
+import os
+import time
+import asyncio
+import httpx
+
+# config.py requires these; no database or real provider is touched
+os.environ.setdefault("DATABASE_URL", "postgres://localhost/test")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+
+import llm_gateway
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+async def _hang(request: httpx.Request) -> httpx.Response:
+    await asyncio.sleep(3600)
+    return httpx.Response(200)
+
+async def _stream_one_piece(request: httpx.Request) -> httpx.Response:
+    chunk = 'data: {"choices": [{"delta": {"content": "hi"}}]}\n\n'
+    return httpx.Response(200, content=chunk.encode() + b"data: [DONE]\n\n")
+
+def _half_open(handler) -> llm_gateway.CircuitBreaker:
+    """Only OpenRouter configured, its breaker past cooldown, and a mocked transport."""
+    for provider in llm_gateway.PROVIDERS:
+        provider.breaker = llm_gateway.CircuitBreaker(threshold=1, cooldown=30)
+    openrouter, ollama = llm_gateway.PROVIDERS
+    openrouter.api_key = "test"
+    ollama.model = None
+    breaker = openrouter.breaker
+    breaker.failures = 1
+    breaker.opened_at = time.monotonic() - breaker.cooldown - 1
+    llm_gateway._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    assert breaker.state == "half-open"
+    return breaker
+
+def test_cancelled_trial_releases_breaker():
+    async def run():
+        breaker = _half_open(_hang)
+        task = asyncio.create_task(llm_gateway.complete(MESSAGES, site="test", deadline=60))
+        await asyncio.sleep(0.05)
+        assert breaker.trial_in_flight
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert not breaker.trial_in_flight
+        assert breaker.allow()
+        await llm_gateway.aclose()
+
+    asyncio.run(run())
+
+def test_abandoned_stream_releases_breaker():
+    async def run():
+        breaker = _half_open(_stream_one_piece)
+        pieces = llm_gateway.stream(MESSAGES, site="test", deadline=60)
+        assert await anext(pieces) == "hi"
+        assert breaker.trial_in_flight
+        await pieces.aclose()
+        assert not breaker.trial_in_flight
+        assert breaker.allow()
+        await llm_gateway.aclose()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_cancelled_trial_releases_breaker()
+    test_abandoned_stream_releases_breaker()
+    print("✅ llm_gateway breaker tests passed")
@@ -0,0 +1,145 @@
+import os
+import logging
+import asyncio
+from datetime import date
+from telegram.ext import ContextTypes
+from db import acquire
+import rollups
+import leaderboard_index
+import scheduler
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Dirty rows are written back this often; it also bounds what a crash can lose
+TODAY_CACHE_FLUSH_SECONDS = float(os.getenv("TODAY_CACHE_FLUSH_SECONDS", "5"))
+
+# (user_id, user's local date) -> {"goal": int, "done": int, "dirty": bool}
+_entries: dict[tuple[int, date], dict] = {}
+_flush_lock = asyncio.Lock()
+_stats = {"hits": 0, "misses": 0, "flushes": 0, "rows_flushed": 0}
+
+# =========================================
+# Reads
+# =========================================
+async def get(user_id: int, create: bool = True) -> tuple[int, int]:
+    """
+    Return today's (goal, done) for a user, from memory when possible.
+    On a miss the row is loaded with one query; a user without a row today
+    inherits their latest goal, and with `create` the new row is queued for
+    the next flush (same as the old get_or_create_today).
+    """
+    entry = await _entry(user_id, create)
+    return entry["goal"], entry["done"]
+
+def peek(user_id: int) -> tuple[int, int] | None:
+    """Today's cached (goal, done) without touching Postgres, or None."""
+    entry = _entries.get((user_id, _today(user_id)))
+    return (entry["goal"], entry["done"]) if entry else None
+
+# =========================================
+# Writes (absorbed in memory, flushed in batches)
+# =========================================
+async def increment(user_id: int, n: int = 1) -> tuple[int, int]:
+    entry = await _entry(user_id, create=True)
+    entry["done"] += n
+    return _written(user_id, entry)
+
+async def set_goal(user_id: int, goal: int) -> tuple[int, int]:
+    entry = await _entry(user_id, create=True)
+    entry["goal"] = goal
+    return _written(user_id, entry)
+
+async def set_done(user_id: int, done: int) -> tuple[int, int]:
+    entry = await _entry(user_id, create=True)
+    entry["done"] = done
+    return _written(user_id, entry)
+
+async def flush():
+    """Write every dirty row to daily_track in one batch and refresh their rollups."""
+    async with _flush_lock:
+        dirty = [(key, entry) for key, entry in _entries.items() if entry["dirty"]]
+        if dirty:
+            records = [(uid, day, entry["goal"], entry["done"]) for (uid, day), entry in dirty]
+            for _, entry in dirty:
+                entry["dirty"] = False
+            try:
+                async with acquire() as conn:
+                    async with conn.transaction():
+                        await conn.executemany(
+                            "INSERT INTO daily_track (user_id, date, goal, done) VALUES ($1, $2, $3, $4) "
+                            "ON CONFLICT (user_id, date) DO UPDATE SET goal = EXCLUDED.goal, done = EXCLUDED.done",
+                            records
+                        )
+                        # Keep the week/month rollups in step with the rows just written
+                        await rollups.refresh(conn, [(uid, day) for (uid, day), _ in dirty])
+                _stats["flushes"] += 1
+                _stats["rows_flushed"] += len(records)
+            except Exception as e:
+                logger.error(f"daily_track flush failed, will retry {len(records)} rows: {e}")
+                for _, entry in dirty:
+                    entry["dirty"] = True
+                return
+        _expire()
+
+def start(job_queue):
+    job_queue.run_repeating(_flush_job, interval=TODAY_CACHE_FLUSH_SECONDS, name="today-cache-flush")
+
+def get_stats() -> dict:
+    return {
+        **_stats,
+        "entries": len(_entries),
+        "dirty": sum(1 for entry in _entries.values() if entry["dirty"]),
+    }
+
+# =========================================
+# Internals
+# =========================================
+async def _flush_job(context: ContextTypes.DEFAULT_TYPE):
+    await flush()
+
+def _written(user_id: int, entry: dict) -> tuple[int, int]:
+    entry["dirty"] = True
+    leaderboard_index.update(user_id, entry["done"], _today(user_id))
+    return entry["goal"], entry["done"]
+
+def _today(user_id: int) -> date:
+    """Rows roll over at the user's local midnight, not the server's."""
+    return scheduler.user_date(user_id)
+
+def _expire():
+    """Drop rows from previous local days once they are flushed (midnight rollover)."""
+    for key in [key for key, entry in _entries.items() if not entry["dirty"] and key[1] != _today(key[0])]:
+        del _entries[key]
+
+async def _entry(user_id: int, create: bool) -> dict:
+    key = (user_id, _today(user_id))
+    entry = _entries.get(key)
+    if entry is not None:
+        _stats["hits"] += 1
+        return _materialise(entry, create)
+
+    _stats["misses"] += 1
+    # Today's row by exact date; otherwise the latest earlier row, only for its goal.
+    # Never a later one: rows dated past the user's local today (after a westward
+    # timezone change) must not hide today's real count.
+    async with acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT date, goal, done FROM daily_track WHERE user_id = $1 AND date <= $2 "
+            "ORDER BY date DESC LIMIT 1",
+            user_id, key[1]
+        )
+    if row and row["date"] == key[1]:
+        loaded = {"goal": row["goal"], "done": row["done"], "dirty": False}
+    else:
+        loaded = {"goal": row["goal"] if row else 0, "done": 0, "dirty": create}
+        if not create:
+            # Not in Postgres yet; the first write turns it into a real row
+            loaded["virtual"] = True
+    # Another coroutine may have loaded the same row while we were waiting
+    return _materialise(_entries.setdefault(key, loaded), create)
+
+def _materialise(entry: dict, create: bool) -> dict:
+    if create and entry.pop("virtual", False):
+        entry["dirty"] = True
+    return entry
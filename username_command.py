@@ -7,7 +7,8 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from db import get_pg_conn  # your asyncpg connector
+from db import acquire  # pooled asyncpg connections
+import leaderboard_index
 
 logger = logging.getLogger(__name__)
 
@@ -18,15 +19,12 @@ async def start_setname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info("🚀 /setname command received")
     user_id = update.effective_user.id
 
-    conn = await get_pg_conn()
-    try:
+    async with acquire() as conn:
         row = await conn.fetchrow(
             "SELECT username FROM users WHERE user_id = $1",
             user_id
         )
         current_name = row["username"] if row and row["username"] else None
-    finally:
-        await conn.close()
 
     if current_name:
         await update.message.reply_text(
@@ -48,26 +46,25 @@ async def receive_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Please provide a valid name.")
         return NAME
 
-    conn = await get_pg_conn()
     try:
         # upsert into your Postgres users table
-        await conn.execute(
-            """
-            INSERT INTO users (user_id, username, first_name)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (user_id)
-              DO UPDATE SET username = EXCLUDED.username
-            """,
-            user_id, name, update.effective_user.first_name or ""
-        )
+        async with acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO users (user_id, username, first_name)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (user_id)
+                  DO UPDATE SET username = EXCLUDED.username
+                """,
+                user_id, name, update.effective_user.first_name or ""
+            )
     except Exception as e:
         logger.error(f"Database error saving name: {e}")
         await update.message.reply_text(
             "❌ Something went wrong saving your name, please try again later."
         )
         return ConversationHandler.END
-    finally:
-        await conn.close()
+    leaderboard_index.set_name(user_id, name)
 
     await update.message.reply_text(
         f"🎉 Your display name has been updated to *{name}*!",
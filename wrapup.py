@@ -4,80 +4,59 @@ import random
 from datetime import date
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from telegram.ext import Application
-from db import get_pg_conn, get_user_profiles, save_wrapup_log
-import httpx
+from db import acquire, get_user_profiles, WrapupLogWriter
 import logging
+import llm_gateway
+import gif_service
+import leaderboard_index
+from broadcast import broadcast, Outgoing
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 # --- Configuration ---
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "")
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
-OPENROUTER_KEY = os.getenv("OPENROUTER_API_KEY", "")
-OPENROUTER_ENDPOINT = "https://openrouter.ai/api/v1/chat/completions"
-GIPHY_KEY = os.getenv("GIPHY_API_KEY", "")
-GIPHY_ENDPOINT = "https://api.giphy.com/v1/gifs/random"
+LLM_TIMEOUT = float(os.getenv("WRAPUP_LLM_TIMEOUT", "30"))          # total seconds per completion
+NUDGE_CONCURRENCY = int(os.getenv("WRAPUP_NUDGE_CONCURRENCY", "10"))
+WRAPUP_MODEL = "gpt-3.5-turbo"
+WRAPUP_SYSTEM_PROMPT = "You are a cold, elite headhunter with a sharp tongue and high standards. Keep it short, human, no fluff."
+WRAPUP_GIF_TAG = "space cat"
+WRAPUP_GIF_RATING = "G"
 
 # --- Helper Functions ---
-async def fetch_leaderboard_positions() -> tuple[tuple[int, int], tuple[int, int]]:
-    conn = await get_pg_conn()
-    today = date.today().isoformat()
-    rows = await conn.fetch(
-        "SELECT user_id, done FROM daily_track WHERE date = $1 ORDER BY done DESC",
-        today
-    )
-    await conn.close()
-    if not rows:
+def fetch_leaderboard_positions(user_profiles: dict[int, dict]) -> tuple[tuple[int, int], tuple[int, int]]:
+    """
+    Top and lowest (user_id, done) among the users being wrapped up. A wrap-up
+    covers one timezone bucket's local day, so it ranks that bucket's profiles
+    rather than the server-day board, whose users may have no profile or name here.
+    """
+    if not user_profiles:
         return (None, 0), (None, 0)
-    return (rows[0]['user_id'], rows[0]['done']), (rows[-1]['user_id'], rows[-1]['done'])
+    ranked = sorted(user_profiles.items(), key=lambda item: (-item[1]["done"], item[0]))
+    (top_id, top), (least_id, least) = ranked[0], ranked[-1]
+    return (top_id, top["done"]), (least_id, least["done"])
+
+def display_name(user_id: int, chat_names: dict[int, str]) -> str:
+    return chat_names.get(user_id) or leaderboard_index.display_name(user_id)
 
 async def get_cat_gif_url() -> str:
-    if not GIPHY_KEY:
-        return "https://media.giphy.com/media/JIX9t2j0ZTN9S/giphy.gif"
-    params = {"api_key": GIPHY_KEY, "tag": "space cat", "rating": "G"}
-    try:
-        resp = httpx.get(GIPHY_ENDPOINT, params=params, timeout=5)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("data", {}).get("images", {}).get("original", {}).get("url", "")
-    except Exception as e:
-        logger.error(f"Giphy API error: {e}")
-        return "https://media.giphy.com/media/JIX9t2j0ZTN9S/giphy.gif"
-
-async def call_openrouter(prompt: str) -> str:
-    if not OPENROUTER_KEY:
-        raise RuntimeError("No OpenRouter API key configured.")
-    headers = {"Authorization": f"Bearer {OPENROUTER_KEY}"}
-    payload = {
-        "model": "gpt-3.5-turbo",
-        "messages": [
-            {"role": "system", "content": "You are a cold, elite headhunter with a sharp tongue and high standards. Keep it short, human, no fluff."},
-            {"role": "user", "content": prompt}
-        ],
-        "max_tokens": 400
-    }
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(OPENROUTER_ENDPOINT, headers=headers, json=payload)
-        resp.raise_for_status()
-        data = resp.json()
-        return data['choices'][0]['message']['content'].strip()
-
-async def call_ollama(prompt: str) -> str:
-    async with httpx.AsyncClient() as client:
-        payload = {"model": OLLAMA_MODEL, "prompt": prompt, "max_tokens": 300}
-        url = f"{OLLAMA_URL}/v1/chat/completions"
-        resp = await client.post(url, json=payload)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get('choices', [])[0].get('message', {}).get('content', '').strip()
+    return gif_service.get_gif(WRAPUP_GIF_TAG, rating=WRAPUP_GIF_RATING)
+
+async def call_llm(prompt: str, site: str, max_tokens: int = 400) -> str:
+    """One completion through the gateway (OpenRouter, failing over to Ollama)."""
+    messages = [
+        {"role": "system", "content": WRAPUP_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    return await llm_gateway.complete(
+        messages, site=site, model=WRAPUP_MODEL, max_tokens=max_tokens, deadline=LLM_TIMEOUT
+    )
 
 # --- Group Wrap-Up Message ---
 async def build_wrapup_message(top, least, chat_names, user_profiles) -> str:
     top_id, top_count = top
     least_id, least_count = least
-    top_name = chat_names.get(top_id, str(top_id))
-    least_name = chat_names.get(least_id, str(least_id))
+    top_name = display_name(top_id, chat_names)
+    least_name = display_name(least_id, chat_names)
     top_goal = user_profiles.get(top_id, {}).get("goal", 10)
     least_goal = user_profiles.get(least_id, {}).get("goal", 10)
     top_trait = user_profiles.get(top_id, {}).get("trait", "focused")
@@ -96,12 +75,7 @@ Tone: cold, direct, tactical. No fluff. Tips should be concrete and realistic.
 """
 
     try:
-        if OPENROUTER_KEY:
-            logger.info("Trying OpenRouter for wrapup message...")
-            return await call_openrouter(prompt)
-        elif OLLAMA_MODEL:
-            logger.info("Trying Ollama for wrapup message...")
-            return await call_ollama(prompt)
+        return await call_llm(prompt, site="wrapup_group")
     except Exception as e:
         logger.error(f"LLM error: {e}")
 
@@ -115,30 +89,14 @@ Tone: cold, direct, tactical. No fluff. Tips should be concrete and realistic.
         "One percent better tomorrow."
     )
 
-# --- Main Scheduler Function ---
-async def send_wrapup(application: Application, chat_ids: list[int], chat_names: dict[int, str], user_profiles: dict[int, dict]):
-    top, least = await fetch_leaderboard_positions()
-    group_msg = await build_wrapup_message(top, least, chat_names, user_profiles)
-    gif_url = await get_cat_gif_url()
-
-    # Group leaderboard wrap-up
-    for chat_id in chat_ids:
-        await application.bot.send_message(chat_id=chat_id, text=group_msg)
-        await application.bot.send_animation(chat_id=chat_id, animation=gif_url)
-
-    await save_wrapup_log(group_msg, date.today(), user_id=None)
-
-    # Personalized nudges
-    for chat_id in chat_ids:
-        profile = user_profiles.get(chat_id, {})
-        name = chat_names.get(chat_id, str(chat_id))
-        done = profile.get("done", 0)
-        goal = profile.get("goal", 10)
-        streak = profile.get("streak", 0)
-        trait = profile.get("trait", "ambiguous mystery")
-        percent = int((done / goal) * 100) if goal else 0
-
-        prompt = f"""Create a 4-line cold motivational message for a job seeker:
+# --- Personal Nudges ---
+def build_nudge_prompt(name: str, profile: dict) -> str:
+    done = profile.get("done", 0)
+    goal = profile.get("goal", 10)
+    streak = profile.get("streak", 0)
+    trait = profile.get("trait", "ambiguous mystery")
+    percent = int((done / goal) * 100) if goal else 0
+    return f"""Create a 4-line cold motivational message for a job seeker:
 Name: {name}
 Done: {done}/{goal} ({percent}%)
 Streak: {streak} days
@@ -147,17 +105,79 @@ Personality: {trait}
 Tone: cold, elite coach. Include one sharp tip. End with 'One percent better tomorrow.'
 """
 
-        try:
-            message = await call_openrouter(prompt)
-        except Exception as e:
-            logger.warning(f"Fallback message for {name} due to LLM error: {e}")
-            message = f"{name}, you did {done}/{goal}. Get back in gear tomorrow.\nOne percent better tomorrow."
+def fallback_nudge(name: str, profile: dict) -> str:
+    done = profile.get("done", 0)
+    goal = profile.get("goal", 10)
+    return f"{name}, you did {done}/{goal}. Get back in gear tomorrow.\nOne percent better tomorrow."
 
-        gif = await get_cat_gif_url()
-        await application.bot.send_message(chat_id=chat_id, text=message)
-        await application.bot.send_animation(chat_id=chat_id, animation=gif)
+async def generate_nudges(chat_ids: list[int], chat_names: dict[int, str], user_profiles: dict[int, dict]) -> dict[int, str]:
+    """
+    Generate every user's nudge concurrently (at most NUDGE_CONCURRENCY LLM calls in flight).
+    A failed or timed-out call falls back to the template message for that user only.
+    """
+    semaphore = asyncio.Semaphore(NUDGE_CONCURRENCY)
+
+    async def generate(chat_id: int) -> str:
+        profile = user_profiles.get(chat_id, {})
+        name = display_name(chat_id, chat_names)
+        async with semaphore:
+            try:
+                return await call_llm(build_nudge_prompt(name, profile), site="wrapup_nudge", max_tokens=300)
+            except Exception as e:
+                logger.warning(f"Fallback message for {name} due to LLM error: {e!r}")
+                return fallback_nudge(name, profile)
 
-        await save_wrapup_log(message, date.today(), user_id=chat_id)
+    messages = await asyncio.gather(*(generate(chat_id) for chat_id in chat_ids))
+    return dict(zip(chat_ids, messages))
+
+# --- Main Scheduler Function ---
+async def send_wrapup(application: Application, chat_ids: list[int], chat_names: dict[int, str],
+                      user_profiles: dict[int, dict] | None = None, day: date | None = None):
+    user_profiles = user_profiles or {}
+    day = day or date.today()
+    # Callers flush the write-behind cache before building user_profiles
+    top, least = fetch_leaderboard_positions(user_profiles)
+    group_msg = await build_wrapup_message(top, least, chat_names, user_profiles)
+    gif_url = await get_cat_gif_url()
+
+    # Nudge generation runs while the group message goes out
+    nudges_task = asyncio.create_task(generate_nudges(chat_ids, chat_names, user_profiles))
+
+    # Group leaderboard wrap-up
+    group_report = await broadcast(
+        application.bot,
+        [Outgoing(chat_id, text=group_msg, animation=gif_url) for chat_id in chat_ids],
+        label="wrap-up group message",
+    )
+
+    wrapup_log = WrapupLogWriter()
+    wrapup_log.add(group_msg, day, user_id=None)
+
+    # Personalized nudges (skip anyone who blocked the bot during the group send)
+    nudges = {
+        chat_id: message for chat_id, message in (await nudges_task).items()
+        if chat_id not in group_report.blocked
+    }
+
+    nudge_report = await broadcast(
+        application.bot,
+        [Outgoing(chat_id, text=message, animation=await get_cat_gif_url()) for chat_id, message in nudges.items()],
+        label="wrap-up nudges",
+    )
+
+    for chat_id, message in nudges.items():
+        if chat_id not in nudge_report.blocked:
+            wrapup_log.add(message, day, user_id=chat_id)
+    await wrapup_log.close()
+
+    blocked = group_report.blocked | nudge_report.blocked
+    logger.info(
+        f"🌙 Wrap-up finished for {len(chat_ids)} chats: "
+        f"{group_report.sent + nudge_report.sent} sent, "
+        f"{group_report.failed + nudge_report.failed} failed, {len(blocked)} blocked, "
+        f"{group_report.elapsed + nudge_report.elapsed:.1f}s sending"
+    )
+    return group_report, nudge_report
 
 # Optional: test manually
 if __name__ == "__main__":
@@ -168,12 +188,11 @@ if __name__ == "__main__":
         app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
         user_profiles = await get_user_profiles()
         chat_ids = list(user_profiles.keys())
-        conn = await get_pg_conn()
-        rows = await conn.fetch(
-            "SELECT user_id, COALESCE(NULLIF(username, ''), first_name) AS name FROM users WHERE user_id = ANY($1::BIGINT[])",
-            chat_ids
-        )
-        await conn.close()
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT user_id, COALESCE(NULLIF(username, ''), first_name) AS name FROM users WHERE user_id = ANY($1::BIGINT[])",
+                chat_ids
+            )
         chat_names = {r["user_id"]: r["name"] for r in rows}
         await send_wrapup(app, chat_ids, chat_names, user_profiles)
 